@@ -0,0 +1,269 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""Benchmarks for the scheduler and controller hot paths.
+
+Seeds a database with periodic tasks and times the scheduler and controller
+functions, writing the results as JSON so runs can be compared across commits:
+
+    python benchmarks/run.py --counts 1000 10000 --output bench.json
+"""
+
+import argparse
+import datetime as dt
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import celery
+import pytz
+import sqlalchemy
+from celery import Celery
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from rdbbeat import controller
+from rdbbeat.data_models import ScheduledTask
+from rdbbeat.db.models import Base, CrontabSchedule, PeriodicTask, crontab_fingerprint
+from rdbbeat.schedulers import DatabaseScheduler
+from rdbbeat.tzcrontab import TzAwareCrontab
+
+DEFAULT_COUNTS = [1000, 10000]
+
+# Number of tasks sharing each crontab in the seeded database.
+TASKS_PER_CRONTAB = 100
+
+
+def create_sqlite_engine() -> sqlalchemy.engine.Engine:
+    engine = create_engine(
+        "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(engine, "connect")
+    def attach_scheduler_schema(dbapi_connection: Any, connection_record: Any) -> None:
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS scheduler")
+
+    return engine
+
+
+def make_session_scope(engine: sqlalchemy.engine.Engine) -> Callable:
+    session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+
+    @contextmanager
+    def session_scope() -> Iterator[Session]:
+        session = session_factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    return session_scope
+
+
+def seed(engine: sqlalchemy.engine.Engine, count: int) -> None:
+    """Recreate the tables with `count` periodic tasks all due right away."""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    crontabs = max(count // TASKS_PER_CRONTAB, 1)
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(days=1)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(CrontabSchedule.__table__),
+            [
+                {
+                    "id": i + 1,
+                    "minute": str(i % 60),
+                    "hour": str(i // 60 % 24),
+                    "day_of_week": "*",
+                    "day_of_month": "*",
+                    "month_of_year": "*",
+                    "timezone": "UTC",
+                    # Core inserts skip the listener setting it
+                    "fingerprint": crontab_fingerprint(str(i % 60), str(i // 60 % 24)),
+                }
+                for i in range(crontabs)
+            ],
+        )
+        connection.execute(
+            insert(PeriodicTask.__table__),
+            [
+                {
+                    "name": f"task_{i}",
+                    "task": "echo",
+                    "crontab_id": i % crontabs + 1,
+                    "args": "[]",
+                    "kwargs": "{}",
+                    "queue": f"queue_{i % 4}",
+                    "one_off": False,
+                    "enabled": True,
+                    "last_run_at": last_run_at,
+                    "total_run_count": 0,
+                }
+                for i in range(count)
+            ],
+        )
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+    }
+
+
+def scheduler_benchmarks(
+    app: Celery, session_scope: Callable, count: int
+) -> Dict[str, Callable[[], Any]]:
+    scheduler = DatabaseScheduler(app=app, session_scope=session_scope, lazy=True)
+    scheduler.schedule  # initial read
+    crontabs = [entry.schedule for entry in list(scheduler.schedule.values())[:1000]]
+    ticks = min(count, 1000)
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(days=1)
+
+    def sync() -> None:
+        scheduler._dirty |= set(scheduler.schedule)
+        scheduler.sync()
+
+    def tick_due() -> None:
+        scheduler.populate_heap()
+        for _ in range(ticks):
+            scheduler.tick()
+
+    def is_due() -> None:
+        for crontab in crontabs:
+            crontab.is_due(last_run_at)
+
+    return {
+        "scheduler.all_as_schedule": scheduler.all_as_schedule,
+        "scheduler.schedule_changed": scheduler.schedule_changed,
+        "scheduler.sync": sync,
+        f"scheduler.tick_due_{ticks}": tick_due,
+        f"tzcrontab.is_due_{len(crontabs)}": is_due,
+        "tzcrontab.construct": lambda: TzAwareCrontab(minute="*/5", hour="1-5"),
+    }
+
+
+def controller_benchmarks(session_scope: Callable, count: int) -> Dict[str, Callable[[], Any]]:
+    scheduled_task = ScheduledTask.parse_obj(
+        {"name": "bench", "task": "echo", "schedule": {"minute": "7", "hour": "3"}}
+    )
+
+    @contextmanager
+    def rolled_back() -> Iterator[Session]:
+        with session_scope() as session:
+            yield session
+            session.flush()
+            session.rollback()
+
+    def existing_id(session: Session) -> int:
+        return session.query(PeriodicTask.id).filter_by(name=f"task_{count // 2}").scalar()
+
+    def schedule_task() -> None:
+        with rolled_back() as session:
+            controller.schedule_task(session, scheduled_task)
+
+    def update_task() -> None:
+        with rolled_back() as session:
+            controller.update_task(session, scheduled_task, existing_id(session))
+
+    def update_task_enabled_status() -> None:
+        with rolled_back() as session:
+            controller.update_task_enabled_status(session, False, existing_id(session))
+
+    def delete_task() -> None:
+        with rolled_back() as session:
+            controller.delete_task(session, existing_id(session))
+
+    def get_crontab_schedule() -> None:
+        with rolled_back() as session:
+            controller.get_crontab_schedule(session, scheduled_task.schedule)
+
+    def is_crontab_used() -> None:
+        with rolled_back() as session:
+            controller.is_crontab_used(session, session.query(CrontabSchedule).first())
+
+    return {
+        "controller.schedule_task": schedule_task,
+        "controller.update_task": update_task,
+        "controller.update_task_enabled_status": update_task_enabled_status,
+        "controller.delete_task": delete_task,
+        "controller.get_crontab_schedule": get_crontab_schedule,
+        "controller.is_crontab_used": is_crontab_used,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(counts: List[int], repeat: int, only: Optional[str] = None) -> Dict:
+    engine = create_sqlite_engine()
+    session_scope = make_session_scope(engine)
+    app = Celery("benchmarks", broker="memory://")
+    app.conf.update({"session_scope": session_scope, "result_expires": None})
+
+    results = []
+    for count in counts:
+        seed(engine, count)
+        benchmarks = scheduler_benchmarks(app, session_scope, count)
+        benchmarks.update(controller_benchmarks(session_scope, count))
+        for name, function in benchmarks.items():
+            if only and only not in name:
+                continue
+            timings = measure(function, repeat)
+            results.append({"benchmark": name, "count": count, "repeat": repeat, **timings})
+            print(f"{name:<45} {count:>8} {timings['median'] * 1000:>12.3f} ms", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": dt.datetime.now(pytz.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "celery": celery.__version__,
+            "sqlalchemy": sqlalchemy.__version__,
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--counts", type=int, nargs="+", default=DEFAULT_COUNTS, help="periodic tasks to seed"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    parser.add_argument("--only", help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = run(args.counts, args.repeat, args.only)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
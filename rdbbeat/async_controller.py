@@ -0,0 +1,126 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""Async counterparts of `rdbbeat.controller` for `AsyncSession`.
+
+Each function runs its synchronous counterpart with `AsyncSession.run_sync`, so the
+semantics are the same, including the change marker bumped when the session commits.
+Relationships of the returned models are not loaded, access them inside `run_sync`.
+"""
+
+from typing import Any, Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from rdbbeat import controller
+from rdbbeat.data_models import Schedule, ScheduledTask
+from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+
+
+async def get_crontab_schedule(session: AsyncSession, schedule: Schedule) -> CrontabSchedule:
+    return await session.run_sync(controller.get_crontab_schedule, schedule)
+
+
+async def schedule_task(
+    session: AsyncSession,
+    scheduled_task: ScheduledTask,
+    queue: Optional[str] = None,
+    exchange: Optional[str] = None,
+    routing_key: Optional[str] = None,
+    **kwargs: Any,
+) -> PeriodicTask:
+    """
+    Schedule a task by adding a periodic task entry.
+    """
+    return await session.run_sync(
+        controller.schedule_task, scheduled_task, queue, exchange, routing_key, **kwargs
+    )
+
+
+async def schedule_tasks(
+    session: AsyncSession,
+    scheduled_tasks: Iterable[ScheduledTask],
+    queue: Optional[str] = None,
+    exchange: Optional[str] = None,
+    routing_key: Optional[str] = None,
+    **kwargs: Any,
+) -> int:
+    """
+    Schedule many tasks at once with bulk statements.
+    """
+    return await session.run_sync(
+        controller.schedule_tasks, scheduled_tasks, queue, exchange, routing_key, **kwargs
+    )
+
+
+async def update_task_enabled_status(
+    session: AsyncSession,
+    enabled_status: bool,
+    periodic_task_id: int,
+) -> PeriodicTask:
+    """
+    Update task enabled status (if task is enabled or disabled).
+    """
+    return await session.run_sync(
+        controller.update_task_enabled_status, enabled_status, periodic_task_id
+    )
+
+
+async def set_tasks_enabled(
+    session: AsyncSession,
+    enabled: bool,
+    ids: Optional[Iterable[int]] = None,
+    task: Optional[str] = None,
+    queue: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+) -> int:
+    """
+    Enable or disable the periodic tasks matching all given criteria in one statement.
+    """
+    return await session.run_sync(
+        controller.set_tasks_enabled, enabled, ids, task, queue, name_prefix
+    )
+
+
+async def update_task(
+    session: AsyncSession,
+    scheduled_task: ScheduledTask,
+    periodic_task_id: int,
+) -> PeriodicTask:
+    """
+    Update the details of a task including the crontab schedule
+    """
+    return await session.run_sync(controller.update_task, scheduled_task, periodic_task_id)
+
+
+async def is_crontab_used(session: AsyncSession, crontab_schedule: CrontabSchedule) -> bool:
+    return await session.run_sync(controller.is_crontab_used, crontab_schedule)
+
+
+async def delete_task(session: AsyncSession, periodic_task_id: int) -> PeriodicTask:
+    return await session.run_sync(controller.delete_task, periodic_task_id)
+
+
+async def delete_tasks(
+    session: AsyncSession,
+    ids: Optional[Iterable[int]] = None,
+    task: Optional[str] = None,
+    queue: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    delete_orphans: bool = True,
+) -> int:
+    """
+    Delete the periodic tasks matching all given criteria in one statement.
+    """
+    return await session.run_sync(
+        controller.delete_tasks, ids, task, queue, name_prefix, delete_orphans
+    )
+
+
+async def delete_orphan_crontabs(session: AsyncSession) -> int:
+    """
+    Delete the crontabs not used by any periodic task, with a single anti-join.
+
+    Crontabs just created by concurrent transactions are deleted too.
+    """
+    return await session.run_sync(controller.delete_orphan_crontabs)
@@ -0,0 +1,136 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+import re
+import select
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+
+from rdbbeat.db.models import PeriodicTaskChanged
+
+DEFAULT_CHANNEL = "rdbbeat_schedule_changed"
+
+
+class ChangeFeed(ABC):
+    """
+    Push notifications about schedule changes, as an alternative to polling.
+
+    Writers announce changes with `notify` from the `PeriodicTaskChanged` listeners,
+    the `DatabaseScheduler` consumes them with `wait` and `poll`.
+    """
+
+    @abstractmethod
+    def notify(self, connection: Connection) -> None:
+        """Announce a change made in the transaction of `connection`."""
+
+    @abstractmethod
+    def wait(self, timeout: float) -> bool:
+        """Block up to `timeout` seconds for a change, without consuming it."""
+
+    @abstractmethod
+    def poll(self) -> bool:
+        """Consume and return whether changes were announced since the last poll."""
+
+    def close(self) -> None:
+        pass
+
+
+class LocalChangeFeed(ChangeFeed):
+    """In-process change feed, works with every database including SQLite."""
+
+    def __init__(self) -> None:
+        self._changed = threading.Event()
+
+    def notify(self, connection: Connection) -> None:
+        if connection.in_transaction():
+            # only wake the scheduler once the change is visible
+            event.listen(connection, "commit", self._set, once=True)
+        else:
+            self._changed.set()
+
+    def _set(self, connection: Connection) -> None:
+        self._changed.set()
+
+    def wait(self, timeout: float) -> bool:
+        return self._changed.wait(timeout)
+
+    def poll(self) -> bool:
+        if self._changed.is_set():
+            self._changed.clear()
+            return True
+        return False
+
+
+class PostgresChangeFeed(ChangeFeed):
+    """
+    Change feed on PostgreSQL LISTEN/NOTIFY.
+
+    Notifications are transactional, they are delivered when the writer commits.
+    Writers only need the channel, the `engine` is needed to listen.
+    """
+
+    def __init__(self, engine: Optional[Engine] = None, channel: str = DEFAULT_CHANNEL) -> None:
+        if not re.match(r"^[a-z_][a-z0-9_]*$", channel):
+            raise ValueError(f"Invalid channel name {channel!r}")
+        self.engine = engine
+        self.channel = channel
+        # pool wrapper of the listening connection, detached from the pool
+        self._fairy: Any = None
+        self._pending = False
+
+    def notify(self, connection: Connection) -> None:
+        connection.execute(text(f"NOTIFY {self.channel}"))
+
+    @property
+    def connection(self) -> Any:
+        """The dedicated DBAPI connection listening on the channel."""
+        if self._fairy is None:
+            if self.engine is None:
+                raise ValueError("An engine is required to listen for changes")
+            fairy = self.engine.raw_connection()
+            # never hand the listening autocommit connection back to the pool
+            fairy.detach()
+            connection = fairy.connection
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            self._fairy = fairy
+        return self._fairy.connection
+
+    def _drain(self) -> None:
+        connection = self.connection
+        connection.poll()
+        if connection.notifies:
+            connection.notifies.clear()
+            self._pending = True
+
+    def wait(self, timeout: float) -> bool:
+        self._drain()
+        if not self._pending and select.select([self.connection], [], [], timeout)[0]:
+            self._drain()
+        return self._pending
+
+    def poll(self) -> bool:
+        self._drain()
+        pending, self._pending = self._pending, False
+        return pending
+
+    def close(self) -> None:
+        if self._fairy is not None:
+            self._fairy.close()
+            self._fairy = None
+
+
+def register_change_feed(feed: ChangeFeed) -> None:
+    """Notify `feed` whenever a periodic task or crontab is changed."""
+    if feed not in PeriodicTaskChanged.change_feeds:
+        PeriodicTaskChanged.change_feeds.append(feed)
+
+
+def unregister_change_feed(feed: ChangeFeed) -> None:
+    if feed in PeriodicTaskChanged.change_feeds:
+        PeriodicTaskChanged.change_feeds.remove(feed)
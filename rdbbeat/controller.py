@@ -2,33 +2,51 @@
 # MIT License
 
 import json
-from typing import Any, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from sqlalchemy import and_
+from sqlalchemy import exists, insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql.elements import ColumnElement
 
 from rdbbeat.data_models import Schedule, ScheduledTask
-from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+from rdbbeat.db.models import (
+    CrontabSchedule,
+    PeriodicTask,
+    PeriodicTaskChanged,
+    PeriodicTaskTombstone,
+    crontab_fingerprint,
+    crontab_memo,
+    memoized_crontab,
+)
 from rdbbeat.exceptions import PeriodicTaskNotFound
+from rdbbeat.tzcrontab import crontab_cache
+
+# Maximum number of crontabs looked up per statement in bulk operations.
+BULK_CHUNK_SIZE = 500
+
+CRONTAB_FIELDS = ("minute", "hour", "day_of_week", "day_of_month", "month_of_year", "timezone")
 
 
 def get_crontab_schedule(session: Session, schedule: Schedule) -> CrontabSchedule:
-    crontab = (
-        session.query(CrontabSchedule)
-        .filter(
-            and_(
-                CrontabSchedule.minute == schedule.minute,
-                CrontabSchedule.hour == schedule.hour,
-                CrontabSchedule.day_of_week == schedule.day_of_week,
-                CrontabSchedule.day_of_month == schedule.day_of_month,
-                CrontabSchedule.month_of_year == schedule.month_of_year,
-                CrontabSchedule.timezone == schedule.timezone,
-            )
-        )
-        .one_or_none()
-    )
-    return crontab or CrontabSchedule(**schedule.dict())
+    """
+    Return the crontab matching `schedule`, or a new one not added to the session yet.
+
+    Crontabs are looked up by fingerprint and memoized for the current transaction,
+    so scheduling many tasks on the same schedule only queries it once.
+    """
+    fingerprint = crontab_fingerprint(*schedule_key(schedule))
+    crontab = memoized_crontab(session, fingerprint)
+    if crontab is None:
+        crontab = (
+            session.query(CrontabSchedule)
+            .filter(CrontabSchedule.fingerprint == fingerprint)
+            .one_or_none()
+        ) or CrontabSchedule(**schedule.dict())
+        # the query may have begun the transaction the memo is bound to
+        crontab_memo(session)[fingerprint] = crontab
+    return crontab
 
 
 def schedule_task(
@@ -51,12 +69,115 @@ def schedule_task(
         queue=queue,
         exchange=exchange,
         routing_key=routing_key,
+        next_run_at=crontab.schedule.next_run_at(),
+        spread_window=scheduled_task.spread_window,
+        catch_up=scheduled_task.catch_up,
     )
     session.add(task)
 
     return task
 
 
+def schedule_key(schedule: Schedule) -> Tuple[str, ...]:
+    return tuple(getattr(schedule, field) for field in CRONTAB_FIELDS)
+
+
+def chunks(items: List, size: int = BULK_CHUNK_SIZE) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        end = start + size
+        yield items[start:end]
+
+
+def get_crontab_schedule_ids(
+    session: Session, schedules: Iterable[Schedule]
+) -> Dict[Tuple[str, ...], int]:
+    """
+    Resolve the crontab ids of many schedules, creating the missing crontabs.
+
+    :returns: crontab id by tuple of the schedule fields, in `CRONTAB_FIELDS` order
+    """
+    keys = {crontab_fingerprint(*key): key for key in map(schedule_key, schedules)}
+
+    def lookup(fingerprints: List[str]) -> Dict[Tuple[str, ...], int]:
+        ids = {}
+        for chunk in chunks(fingerprints):
+            query = select(CrontabSchedule.id, CrontabSchedule.fingerprint).where(
+                CrontabSchedule.fingerprint.in_(chunk)
+            )
+            for crontab_id, fingerprint in session.execute(query):
+                ids[keys[fingerprint]] = crontab_id
+        return ids
+
+    ids = lookup(list(keys))
+    missing = [fingerprint for fingerprint, key in keys.items() if key not in ids]
+    if missing:
+        rows = [
+            dict(zip(CRONTAB_FIELDS, keys[fingerprint]), fingerprint=fingerprint)
+            for fingerprint in missing
+        ]
+        try:
+            with session.begin_nested():
+                session.execute(insert(CrontabSchedule.__table__), rows)
+        except IntegrityError:
+            # some were created concurrently by another writer, insert the others
+            for row in rows:
+                try:
+                    with session.begin_nested():
+                        session.execute(insert(CrontabSchedule.__table__), row)
+                except IntegrityError:
+                    pass
+        ids.update(lookup(missing))
+    return ids
+
+
+def schedule_tasks(
+    session: Session,
+    scheduled_tasks: Iterable[ScheduledTask],
+    queue: Optional[str] = None,
+    exchange: Optional[str] = None,
+    routing_key: Optional[str] = None,
+    **kwargs: Any,
+) -> int:
+    """
+    Schedule many tasks at once with bulk statements.
+
+    Crontabs are resolved or created in one set-based pass and the change marker
+    is bumped once for all tasks.
+
+    :returns: number of scheduled tasks
+    """
+    scheduled_tasks = list(scheduled_tasks)
+    if not scheduled_tasks:
+        return 0
+    crontab_ids = get_crontab_schedule_ids(session, (task.schedule for task in scheduled_tasks))
+    next_run_at = {
+        key: crontab_cache.get(*key).next_run_at()
+        for key in map(schedule_key, (task.schedule for task in scheduled_tasks))
+    }
+    task_kwargs = json.dumps(kwargs)
+    session.execute(
+        insert(PeriodicTask.__table__),
+        [
+            {
+                "crontab_id": crontab_ids[schedule_key(scheduled_task.schedule)],
+                "name": scheduled_task.name,
+                "task": scheduled_task.task,
+                "kwargs": task_kwargs,
+                "queue": queue,
+                "exchange": exchange,
+                "routing_key": routing_key,
+                "next_run_at": next_run_at[schedule_key(scheduled_task.schedule)],
+                "spread_window": scheduled_task.spread_window,
+                "catch_up": scheduled_task.catch_up,
+            }
+            for scheduled_task in scheduled_tasks
+        ],
+    )
+    # bulk statements do not fire the mapper listeners
+    PeriodicTaskChanged.mark_changed(session)
+    return len(scheduled_tasks)
+
+
 def update_task_enabled_status(
     session: Session,
     enabled_status: bool,
@@ -90,6 +211,9 @@ def update_task(
         task.crontab = get_crontab_schedule(session, scheduled_task.schedule)
         task.name = scheduled_task.name
         task.task = scheduled_task.task
+        task.spread_window = scheduled_task.spread_window
+        task.catch_up = scheduled_task.catch_up
+        task.next_run_at = task.crontab.schedule.next_run_at(task.last_run_at)
         session.add(task)
 
     except NoResultFound as e:
@@ -98,6 +222,33 @@ def update_task(
     return task
 
 
+def set_tasks_enabled(
+    session: Session,
+    enabled: bool,
+    ids: Optional[Iterable[int]] = None,
+    task: Optional[str] = None,
+    queue: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+) -> int:
+    """
+    Enable or disable the periodic tasks matching all given criteria in one statement.
+
+    Tasks already loaded in the session are not updated.
+
+    :returns: number of tasks whose enabled status changed
+    """
+    criteria = periodic_task_criteria(ids=ids, task=task, queue=queue, name_prefix=name_prefix)
+    count = (
+        session.query(PeriodicTask)
+        .filter(*criteria, PeriodicTask.enabled.isnot(enabled))
+        .update({PeriodicTask.enabled: enabled}, synchronize_session=False)
+    )
+    if count:
+        # bulk statements do not fire the mapper listeners
+        PeriodicTaskChanged.mark_changed(session)
+    return count
+
+
 def is_crontab_used(session: Session, crontab_schedule: CrontabSchedule) -> bool:
     schedules = session.query(PeriodicTask).filter_by(crontab=crontab_schedule).all()
     return True if schedules else False
@@ -113,3 +264,90 @@ def delete_task(session: Session, periodic_task_id: int) -> PeriodicTask:
         return task
     except NoResultFound as e:
         raise PeriodicTaskNotFound() from e
+
+
+def periodic_task_criteria(
+    ids: Optional[Iterable[int]] = None,
+    task: Optional[str] = None,
+    queue: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+) -> List[ColumnElement]:
+    """
+    Build the criteria selecting periodic tasks for bulk operations, combined with AND.
+
+    :raises ValueError: when no criteria is given, rather than selecting every task
+    """
+    criteria = []
+    if ids is not None:
+        criteria.append(PeriodicTask.id.in_(list(ids)))
+    if task is not None:
+        criteria.append(PeriodicTask.task == task)
+    if queue is not None:
+        criteria.append(PeriodicTask.queue == queue)
+    if name_prefix is not None:
+        criteria.append(PeriodicTask.name.startswith(name_prefix, autoescape=True))
+    if not criteria:
+        raise ValueError("At least one of ids, task, queue or name_prefix is required")
+    return criteria
+
+
+def delete_tasks(
+    session: Session,
+    ids: Optional[Iterable[int]] = None,
+    task: Optional[str] = None,
+    queue: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    delete_orphans: bool = True,
+) -> int:
+    """
+    Delete the periodic tasks matching all given criteria in one statement.
+
+    Tasks already loaded in the session are not updated.
+
+    :param delete_orphans: also delete the crontabs of the deleted tasks no longer used by any
+        task, other orphans are left to `delete_orphan_crontabs`
+    :returns: number of deleted tasks
+    """
+    criteria = periodic_task_criteria(ids=ids, task=task, queue=queue, name_prefix=name_prefix)
+    if delete_orphans:
+        # crontabs orphaned by other transactions may be about to be used
+        crontab_ids = [
+            crontab_id
+            for crontab_id, in session.execute(
+                select(PeriodicTask.crontab_id).where(*criteria).distinct()
+            )
+        ]
+    # bulk statements do not fire the mapper listeners
+    session.execute(
+        insert(PeriodicTaskTombstone).from_select(
+            ["name"], select(PeriodicTask.name).where(*criteria)
+        )
+    )
+    count = session.query(PeriodicTask).filter(*criteria).delete(synchronize_session=False)
+    if count:
+        PeriodicTaskChanged.mark_changed(session)
+    if delete_orphans and crontab_ids:
+        _delete_unused_crontabs(session, CrontabSchedule.id.in_(crontab_ids))
+    return count
+
+
+def delete_orphan_crontabs(session: Session) -> int:
+    """
+    Delete the crontabs not used by any periodic task, with a single anti-join.
+
+    Crontabs just created by concurrent transactions are deleted too, run it when no
+    tasks are being scheduled.
+
+    :returns: number of deleted crontabs
+    """
+    return _delete_unused_crontabs(session)
+
+
+def _delete_unused_crontabs(session: Session, *criteria: ColumnElement) -> int:
+    used = exists().where(PeriodicTask.crontab_id == CrontabSchedule.id)
+    count = (
+        session.query(CrontabSchedule).filter(~used, *criteria).delete(synchronize_session=False)
+    )
+    if count:
+        crontab_memo(session).clear()
+    return count
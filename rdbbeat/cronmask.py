@@ -0,0 +1,134 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""Next fire time computation for crontabs compiled into bitmasks.
+
+Matching follows celery's crontab: a minute matches when its minute, hour, day of
+week, day of month and month of year all match. Fire times are local wall-clock
+minutes of the schedule timezone. Around DST transitions:
+
+- a wall-clock minute that does not exist (spring forward) fires shifted forward by
+  the length of the gap,
+- a wall-clock minute that occurs twice (fall back) fires on its first occurrence,
+  unless the previous run already happened after it.
+"""
+
+import datetime as dt
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pytz
+
+# Crontabs that never match (e.g. 31st of February) give up after this many years.
+MAX_SEARCH_YEARS = 29
+
+_ONE_MINUTE = dt.timedelta(minutes=1)
+_ONE_DAY = dt.timedelta(days=1)
+
+
+def to_mask(values: Iterable[int]) -> int:
+    """Fold a set of cron field values into an integer bitmask."""
+    mask = 0
+    for value in values:
+        mask |= 1 << value
+    return mask
+
+
+def next_bit(mask: int, start: int) -> Optional[int]:
+    """Return the lowest set bit of `mask` at or above `start`."""
+    mask >>= start
+    if not mask:
+        return None
+    return start + (mask & -mask).bit_length() - 1
+
+
+class CronMask:
+    """Crontab fields compiled into bitmasks with a direct next-fire search."""
+
+    __slots__ = ("minutes", "hours", "days_of_week", "days_of_month", "months", "tz")
+
+    def __init__(
+        self,
+        minute: Iterable[int],
+        hour: Iterable[int],
+        day_of_week: Iterable[int],
+        day_of_month: Iterable[int],
+        month_of_year: Iterable[int],
+        tz: dt.tzinfo = pytz.utc,
+    ) -> None:
+        self.minutes = to_mask(minute)
+        self.hours = to_mask(hour)
+        # cron counts days of the week from Sunday = 0
+        self.days_of_week = to_mask(day_of_week)
+        self.days_of_month = to_mask(day_of_month)
+        self.months = to_mask(month_of_year)
+        self.tz = tz
+
+    def next_wall_time(self, after: dt.datetime) -> Optional[dt.datetime]:
+        """Return the first matching naive local minute strictly after naive `after`."""
+        start = after.replace(second=0, microsecond=0) + _ONE_MINUTE
+        day, hour, minute = start.date(), start.hour, start.minute
+        limit = day.replace(year=day.year + MAX_SEARCH_YEARS, day=1)
+
+        while day < limit:
+            if not self.months >> day.month & 1:
+                # skip the whole month
+                year, month = divmod(day.month, 12)
+                day = dt.date(day.year + year, month + 1, 1)
+                hour = minute = 0
+                continue
+
+            dow = (day.weekday() + 1) % 7
+            if self.days_of_month >> day.day & 1 and self.days_of_week >> dow & 1:
+                next_hour = next_bit(self.hours, hour)
+                while next_hour is not None:
+                    next_minute = next_bit(self.minutes, minute if next_hour == hour else 0)
+                    if next_minute is not None:
+                        return dt.datetime.combine(day, dt.time(next_hour, next_minute))
+                    next_hour = next_bit(self.hours, next_hour + 1)
+
+            day += _ONE_DAY
+            hour = minute = 0
+        return None
+
+    def localize(self, wall: dt.datetime) -> Tuple[dt.datetime, ...]:
+        """Return the instants a naive local wall time maps to, earliest first."""
+        tz = self.tz
+        if not isinstance(tz, pytz.BaseTzInfo):
+            return (wall.replace(tzinfo=tz, fold=0), wall.replace(tzinfo=tz, fold=1))
+        try:
+            return (tz.localize(wall, is_dst=None),)
+        except pytz.AmbiguousTimeError:
+            return (tz.localize(wall, is_dst=True), tz.localize(wall, is_dst=False))
+        except pytz.NonExistentTimeError:
+            return (tz.normalize(tz.localize(wall, is_dst=False)),)
+
+    def next_fire(self, last_run_at: dt.datetime) -> Optional[dt.datetime]:
+        """Return the first fire time strictly after the aware `last_run_at`."""
+        wall = last_run_at.astimezone(self.tz).replace(tzinfo=None)
+        while True:
+            next_wall = self.next_wall_time(wall)
+            if next_wall is None:
+                return None
+            wall = next_wall
+            for instant in self.localize(wall):
+                if instant > last_run_at:
+                    return instant
+
+
+def next_fire_times(pairs: Iterable[Tuple[CronMask, dt.datetime]]) -> List[Optional[dt.datetime]]:
+    """
+    Compute the next fire time for many (mask, last_run_at) pairs at once.
+
+    The next fire time only depends on the mask and the minute of the last run, so
+    entries sharing a crontab that ran in the same minute are computed only once.
+    """
+    memo: Dict[Tuple[CronMask, dt.datetime], Optional[dt.datetime]] = {}
+    results = []
+    for mask, last_run_at in pairs:
+        key = (mask, last_run_at.astimezone(pytz.utc).replace(second=0, microsecond=0))
+        try:
+            next_fire = memo[key]
+        except KeyError:
+            next_fire = memo[key] = mask.next_fire(last_run_at)
+        results.append(next_fire)
+    return results
@@ -1,8 +1,12 @@
 # Copyright (c) 2023 Hewlett Packard Enterprise Development LP
 # MIT License
 
+from typing import Optional
+
 from pydantic import BaseModel, validator
 
+from rdbbeat.db.models import CATCH_UP_POLICIES
+
 
 class Schedule(BaseModel):
     minute: str = "*"
@@ -62,3 +66,13 @@ class ScheduledTask(BaseModel):
     name: str
     task: str
     schedule: Schedule
+    # seconds, see `PeriodicTask.spread_window`
+    spread_window: Optional[int] = None
+    # see `PeriodicTask.catch_up`
+    catch_up: Optional[str] = None
+
+    @validator("catch_up")
+    def catch_up_validation(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None and v not in CATCH_UP_POLICIES:
+            raise ValueError(f"Catch-up: '{v}' is not one of {', '.join(CATCH_UP_POLICIES)}")
+        return v
@@ -0,0 +1,44 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""added beat lease table
+
+Revision ID: 3f1c2a7d9b10
+Revises: 6cc745c3fb42
+Create Date: 2026-10-18 09:12:40.512083
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f1c2a7d9b10"
+down_revision = "6cc745c3fb42"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "celery_beat_lease",
+        sa.Column("member_id", sa.String(length=255), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("member_id"),
+        schema="scheduler",
+    )
+    op.create_index(
+        op.f("ix_scheduler_celery_beat_lease_expires_at"),
+        "celery_beat_lease",
+        ["expires_at"],
+        unique=False,
+        schema="scheduler",
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_scheduler_celery_beat_lease_expires_at"),
+        table_name="celery_beat_lease",
+        schema="scheduler",
+    )
+    op.drop_table("celery_beat_lease", schema="scheduler")
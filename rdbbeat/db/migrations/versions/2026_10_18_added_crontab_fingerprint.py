@@ -0,0 +1,90 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""added crontab fingerprint
+
+Revision ID: 8d4e6b2f1a37
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-18 11:02:17.204518
+
+"""
+import hashlib
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8d4e6b2f1a37"
+down_revision = "3f1c2a7d9b10"
+branch_labels = None
+depends_on = None
+
+CRONTAB_FIELDS = ("minute", "hour", "day_of_week", "day_of_month", "month_of_year")
+
+
+def fingerprint(row):
+    # frozen copy of rdbbeat.db.models.crontab_fingerprint
+    expression = " ".join(
+        str(row[field]).replace(" ", "") if row[field] else "*" for field in CRONTAB_FIELDS
+    )
+    return hashlib.sha1(f"{expression} {row['timezone'] or 'UTC'}".encode()).hexdigest()
+
+
+def upgrade():
+    op.add_column(
+        "celery_crontab_schedule",
+        sa.Column("fingerprint", sa.String(length=40), nullable=True),
+        schema="scheduler",
+    )
+
+    connection = op.get_bind()
+    crontabs = sa.table(
+        "celery_crontab_schedule",
+        sa.column("id", sa.Integer),
+        sa.column("fingerprint", sa.String),
+        *(sa.column(field, sa.String) for field in CRONTAB_FIELDS + ("timezone",)),
+        schema="scheduler",
+    )
+    tasks = sa.table(
+        "celery_periodic_task",
+        sa.column("crontab_id", sa.Integer),
+        schema="scheduler",
+    )
+
+    # backfill, merging duplicate crontabs into the one with the lowest id
+    kept = {}
+    duplicates = {}
+    rows = connection.execute(sa.select(crontabs).order_by(crontabs.c.id)).mappings()
+    for row in rows:
+        key = fingerprint(row)
+        if key in kept:
+            duplicates[row["id"]] = kept[key]
+        else:
+            kept[key] = row["id"]
+
+    for duplicate_id, crontab_id in duplicates.items():
+        connection.execute(
+            tasks.update().where(tasks.c.crontab_id == duplicate_id).values(crontab_id=crontab_id)
+        )
+        connection.execute(crontabs.delete().where(crontabs.c.id == duplicate_id))
+    for key, crontab_id in kept.items():
+        connection.execute(
+            crontabs.update().where(crontabs.c.id == crontab_id).values(fingerprint=key)
+        )
+
+    op.create_index(
+        op.f("ix_scheduler_celery_crontab_schedule_fingerprint"),
+        "celery_crontab_schedule",
+        ["fingerprint"],
+        unique=True,
+        schema="scheduler",
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_scheduler_celery_crontab_schedule_fingerprint"),
+        table_name="celery_crontab_schedule",
+        schema="scheduler",
+    )
+    op.drop_column("celery_crontab_schedule", "fingerprint", schema="scheduler")
@@ -0,0 +1,30 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""added periodic task catch_up
+
+Revision ID: c3a91f7e2b58
+Revises: e5b8d3a06c29
+Create Date: 2026-10-18 18:12:40.517236
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c3a91f7e2b58"
+down_revision = "e5b8d3a06c29"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "celery_periodic_task",
+        sa.Column("catch_up", sa.String(length=16), nullable=True),
+        schema="scheduler",
+    )
+
+
+def downgrade():
+    op.drop_column("celery_periodic_task", "catch_up", schema="scheduler")
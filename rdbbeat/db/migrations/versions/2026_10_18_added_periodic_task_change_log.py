@@ -0,0 +1,32 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""added periodic task change log
+
+Revision ID: b72e05c9d4a1
+Revises: 8d4e6b2f1a37
+Create Date: 2026-10-18 13:40:51.870214
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b72e05c9d4a1"
+down_revision = "8d4e6b2f1a37"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "celery_periodic_task_change_log",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("changed_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        schema="scheduler",
+    )
+
+
+def downgrade():
+    op.drop_table("celery_periodic_task_change_log", schema="scheduler")
@@ -0,0 +1,43 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""added periodic task next_run_at
+
+Revision ID: 4a9c17e3f52d
+Revises: b72e05c9d4a1
+Create Date: 2026-10-18 15:21:06.338915
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4a9c17e3f52d"
+down_revision = "b72e05c9d4a1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # left NULL for existing tasks, which are always loaded until their next run is saved
+    op.add_column(
+        "celery_periodic_task",
+        sa.Column("next_run_at", sa.DateTime(timezone=True), nullable=True),
+        schema="scheduler",
+    )
+    op.create_index(
+        op.f("ix_scheduler_celery_periodic_task_next_run_at"),
+        "celery_periodic_task",
+        ["next_run_at"],
+        unique=False,
+        schema="scheduler",
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_scheduler_celery_periodic_task_next_run_at"),
+        table_name="celery_periodic_task",
+        schema="scheduler",
+    )
+    op.drop_column("celery_periodic_task", "next_run_at", schema="scheduler")
@@ -0,0 +1,30 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""added periodic task spread_window
+
+Revision ID: e5b8d3a06c29
+Revises: 4a9c17e3f52d
+Create Date: 2026-10-18 16:47:12.905344
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e5b8d3a06c29"
+down_revision = "4a9c17e3f52d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "celery_periodic_task",
+        sa.Column("spread_window", sa.Integer(), nullable=True),
+        schema="scheduler",
+    )
+
+
+def downgrade():
+    op.drop_column("celery_periodic_task", "spread_window", schema="scheduler")
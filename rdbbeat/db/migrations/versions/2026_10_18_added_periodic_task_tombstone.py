@@ -0,0 +1,45 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""added periodic task tombstone
+
+Revision ID: 9e2d4b7a1c63
+Revises: c3a91f7e2b58
+Create Date: 2026-10-18 18:12:07.415302
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9e2d4b7a1c63"
+down_revision = "c3a91f7e2b58"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "celery_periodic_task_tombstone",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        schema="scheduler",
+    )
+    op.create_index(
+        op.f("ix_scheduler_celery_periodic_task_tombstone_deleted_at"),
+        "celery_periodic_task_tombstone",
+        ["deleted_at"],
+        unique=False,
+        schema="scheduler",
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_scheduler_celery_periodic_task_tombstone_deleted_at"),
+        table_name="celery_periodic_task_tombstone",
+        schema="scheduler",
+    )
+    op.drop_table("celery_periodic_task_tombstone", schema="scheduler")
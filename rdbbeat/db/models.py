@@ -3,22 +3,44 @@
 # MIT License
 
 import datetime as dt
+import hashlib
+import itertools
 import logging
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Optional, Set, Union
 
-import pytz
 import sqlalchemy as sa
 from celery import schedules
 from sqlalchemy import MetaData, func
 from sqlalchemy.engine import Engine
 from sqlalchemy.event import listen
-from sqlalchemy.orm import Session, class_mapper, foreign, relationship, remote, declarative_base
-from sqlalchemy.sql import insert, select, update
-
-from rdbbeat.tzcrontab import TzAwareCrontab
+from sqlalchemy.orm import (
+    Session,
+    class_mapper,
+    declarative_base,
+    foreign,
+    object_session,
+    relationship,
+    remote,
+)
+from sqlalchemy.sql import insert, update
+
+from rdbbeat.tzcrontab import TzAwareCrontab, crontab_cache
 
 logger = logging.getLogger(__name__)
 
+# `Session.info` key flagging a transaction that changed the schedule
+CHANGED_INFO_KEY = "rdbbeat_schedule_changed"
+
+# Change tracking backends, see `PeriodicTaskChanged.tracking`
+CHANGE_MARKER = "marker"
+CHANGE_LOG = "log"
+
+# Catch-up policies for the runs missed while beat was down, see `PeriodicTask.catch_up`
+CATCH_UP_SKIP = "skip"
+CATCH_UP_COALESCE = "coalesce"
+CATCH_UP_REPLAY = "replay"
+CATCH_UP_POLICIES = (CATCH_UP_SKIP, CATCH_UP_COALESCE, CATCH_UP_REPLAY)
+
 Base: Any = declarative_base(metadata=MetaData(schema="scheduler"))
 
 
@@ -27,6 +49,40 @@ def cronexp(field: str) -> str:
     return field and str(field).replace(" ", "") or "*"
 
 
+def crontab_fingerprint(
+    minute: str = "*",
+    hour: str = "*",
+    day_of_week: str = "*",
+    day_of_month: str = "*",
+    month_of_year: str = "*",
+    timezone: str = "UTC",
+) -> str:
+    """Hash of the normalized cron expression and timezone, identifying a crontab."""
+    fields = (minute, hour, day_of_week, day_of_month, month_of_year)
+    expression = " ".join(cronexp(field) for field in fields)
+    return hashlib.sha1(f"{expression} {timezone or 'UTC'}".encode()).hexdigest()
+
+
+def crontab_memo(session: Session) -> Dict[str, "CrontabSchedule"]:
+    """Crontabs looked up in the current transaction of `session`, by fingerprint."""
+    transaction = session.get_transaction()
+    memo = session.info.get("rdbbeat_crontabs")
+    if not memo or memo[0] is not transaction:
+        memo = session.info["rdbbeat_crontabs"] = (transaction, {})
+    return memo[1]
+
+
+def memoized_crontab(session: Session, fingerprint: str) -> Optional["CrontabSchedule"]:
+    """Crontab memoized for `fingerprint` in the current transaction, unless deleted since."""
+    model = crontab_memo(session).get(fingerprint)
+    if model is not None:
+        state = sa.inspect(model)
+        # pending deletion, or deleted by a flush of this transaction
+        if model in session.deleted or state.deleted or state.was_deleted:
+            return None
+    return model
+
+
 class ModelMixin:
     @classmethod
     def create(cls, **kw: Dict) -> "ModelMixin":
@@ -48,16 +104,17 @@ class CrontabSchedule(Base, ModelMixin):
     day_of_month = sa.Column(sa.String(31 * 4), default="*")
     month_of_year = sa.Column(sa.String(64), default="*")
     timezone = sa.Column(sa.String(64), default="UTC")
+    fingerprint = sa.Column(sa.String(40), index=True, unique=True)
 
     @property
     def schedule(self) -> TzAwareCrontab:
-        return TzAwareCrontab(
+        return crontab_cache.get(
             minute=self.minute,
             hour=self.hour,
             day_of_week=self.day_of_week,
             day_of_month=self.day_of_month,
             month_of_year=self.month_of_year,
-            tz=pytz.timezone(self.timezone),
+            timezone=self.timezone,
         )
 
     @classmethod
@@ -71,14 +128,43 @@ class CrontabSchedule(Base, ModelMixin):
         }
         if schedule.tz:
             spec.update({"timezone": schedule.tz.zone})
-        model = session.query(CrontabSchedule).filter_by(**spec).first()
+        fingerprint = crontab_fingerprint(**spec)
+        model = cls.get_by_fingerprint(session, fingerprint)
         if not model:
             model = cls(**spec)
             session.add(model)
-            session.commit()
+            try:
+                session.commit()
+            except sa.exc.IntegrityError:
+                # created concurrently by another writer
+                session.rollback()
+                model = session.query(CrontabSchedule).filter_by(fingerprint=fingerprint).one()
+
+        return model
 
+    @classmethod
+    def get_by_fingerprint(cls, session: Session, fingerprint: str) -> Optional["CrontabSchedule"]:
+        """Look a crontab up by fingerprint, memoized for the current transaction."""
+        model = memoized_crontab(session, fingerprint)
+        if model is None:
+            model = session.query(CrontabSchedule).filter(cls.fingerprint == fingerprint).first()
+            if model is not None:
+                crontab_memo(session)[fingerprint] = model
         return model
 
+    @staticmethod
+    def set_fingerprint(
+        mapper: class_mapper, connection: Engine.connect, target: "CrontabSchedule"
+    ) -> None:
+        target.fingerprint = crontab_fingerprint(
+            target.minute,
+            target.hour,
+            target.day_of_week,
+            target.day_of_month,
+            target.month_of_year,
+            target.timezone,
+        )
+
 
 class PeriodicTaskChanged(Base, ModelMixin):
     """Helper table for tracking updates to periodic tasks."""
@@ -88,6 +174,13 @@ class PeriodicTaskChanged(Base, ModelMixin):
     id = sa.Column(sa.Integer, primary_key=True)
     last_update = sa.Column(sa.DateTime(timezone=True), nullable=False, default=dt.datetime.now)
 
+    # `rdbbeat.changefeed.ChangeFeed` instances notified on every change
+    change_feeds: List[Any] = []
+
+    # CHANGE_MARKER updates the row with id 1, CHANGE_LOG appends to `PeriodicTaskChangeLog`.
+    # Set explicitly in every process, the scheduler refuses a different backend.
+    tracking: str = CHANGE_MARKER
+
     @classmethod
     def changed(
         cls, mapper: class_mapper, connection: Engine.connect, target: "PeriodicTask"
@@ -102,24 +195,64 @@ class PeriodicTaskChanged(Base, ModelMixin):
 
     @classmethod
     def update_changed(
-        cls, mapper: class_mapper, connection: Engine.connect, target: "PeriodicTask"
+        cls, mapper: class_mapper, connection: Engine.connect, target: Optional["PeriodicTask"]
     ) -> None:
         """
         :param mapper: the Mapper which is the target of this event
         :param connection: the Connection being used
         :param target: the mapped instance being persisted
         """
-        s = connection.execute(
-            select([PeriodicTaskChanged]).where(PeriodicTaskChanged.id == 1).limit(1)
-        )
-        if not s:
-            s = connection.execute(insert(PeriodicTaskChanged), last_update=dt.datetime.now())
+        session = object_session(target) if target is not None else None
+        if session is not None:
+            cls.mark_changed(session)
         else:
-            s = connection.execute(
+            cls.bump(connection)
+
+    @classmethod
+    def mark_changed(cls, session: Session) -> None:
+        """Flag `session`, the marker is bumped once when its transaction commits."""
+        session.info[CHANGED_INFO_KEY] = True
+
+    @classmethod
+    def bump(cls, connection: Engine.connect) -> None:
+        """Record a change, advancing the marker in place or appending to the change log."""
+        now = dt.datetime.now()
+        if cls.tracking == CHANGE_LOG:
+            connection.execute(insert(PeriodicTaskChangeLog).values(changed_at=now))
+        else:
+            result = connection.execute(
                 update(PeriodicTaskChanged)
                 .where(PeriodicTaskChanged.id == 1)
-                .values(last_update=dt.datetime.now())
+                .values(last_update=now)
             )
+            if not result.rowcount:
+                connection.execute(insert(PeriodicTaskChanged).values(id=1, last_update=now))
+        for feed in cls.change_feeds:
+            feed.notify(connection)
+
+    @classmethod
+    def before_commit(cls, session: Session) -> None:
+        # sessions of the application not touching the schedule are left alone
+        pending = itertools.chain(session.new, session.dirty, session.deleted)
+        if not session.info.get(CHANGED_INFO_KEY) and not any(
+            isinstance(obj, (PeriodicTask, CrontabSchedule)) for obj in pending
+        ):
+            return
+        # pending changes are only flagged once flushed
+        session.flush()
+        if session.info.pop(CHANGED_INFO_KEY, False):
+            cls.bump(session.connection())
+
+    @classmethod
+    def after_commit(cls, session: Session) -> None:
+        # flagged by a flush after `before_commit`, too late to bump the marker
+        session.info.pop(CHANGED_INFO_KEY, None)
+
+    @classmethod
+    def after_soft_rollback(cls, session: Session, previous_transaction: Any) -> None:
+        # a savepoint rollback keeps the changes flushed before the savepoint
+        if previous_transaction.parent is None:
+            session.info.pop(CHANGED_INFO_KEY, None)
 
     @classmethod
     def last_change(cls, session: Session) -> Union[dt.datetime, None]:
@@ -129,6 +262,79 @@ class PeriodicTaskChanged(Base, ModelMixin):
         return None
 
 
+class PeriodicTaskChangeLog(Base, ModelMixin):
+    """
+    Append-only log of changes to periodic tasks.
+
+    Concurrent writers insert rows instead of contending on the `PeriodicTaskChanged` row,
+    readers compare the recent sequences with the ones they have seen. A sequence can
+    commit after higher ones, readers look back rather than only at the highest.
+    """
+
+    __tablename__ = "celery_periodic_task_change_log"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    changed_at = sa.Column(sa.DateTime(timezone=True), nullable=False, default=dt.datetime.now)
+
+    @classmethod
+    def last_sequence(cls, session: Session) -> Optional[int]:
+        return session.query(func.max(cls.id)).scalar()
+
+    @classmethod
+    def sequences_after(cls, session: Session, after: int) -> Set[int]:
+        return {sequence for sequence, in session.query(cls.id).filter(cls.id > after)}
+
+    @classmethod
+    def prune(cls, session: Session, before: int) -> int:
+        """Delete the entries with a sequence lower than `before`, returns their count."""
+        return session.query(cls).filter(cls.id < before).delete(synchronize_session=False)
+
+
+class PeriodicTaskTombstone(Base, ModelMixin):
+    """
+    Names of the periodic tasks deleted or renamed.
+
+    Delta reloads of the scheduler find the removed entries here, rather than comparing
+    the whole schedule with the table. Full reloads prune the old tombstones.
+    """
+
+    __tablename__ = "celery_periodic_task_tombstone"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String(255), nullable=False)
+    # same clock as `PeriodicTask.date_changed`
+    deleted_at = sa.Column(
+        sa.DateTime(timezone=True), nullable=False, default=func.now(), index=True
+    )
+
+    @classmethod
+    def deleted(
+        cls, mapper: class_mapper, connection: Engine.connect, target: "PeriodicTask"
+    ) -> None:
+        connection.execute(insert(cls).values(name=target.name))
+
+    @classmethod
+    def renamed(
+        cls, mapper: class_mapper, connection: Engine.connect, target: "PeriodicTask"
+    ) -> None:
+        for name in sa.inspect(target).attrs.name.history.deleted:
+            if name is not None:
+                connection.execute(insert(cls).values(name=name))
+
+    @classmethod
+    def since(cls, session: Session, watermark: Optional[dt.datetime]) -> List[Any]:
+        """Return the (name, deleted_at) of the tombstones at or after `watermark`."""
+        query = session.query(cls.name, cls.deleted_at)
+        if watermark is not None:
+            query = query.filter(cls.deleted_at >= watermark)
+        return query.all()
+
+    @classmethod
+    def prune(cls, session: Session, before: dt.datetime) -> int:
+        """Delete the tombstones older than `before`, returns their count."""
+        return session.query(cls).filter(cls.deleted_at < before).delete(synchronize_session=False)
+
+
 class PeriodicTask(Base, ModelMixin):
     __tablename__ = "celery_periodic_task"
 
@@ -162,6 +368,13 @@ class PeriodicTask(Base, ModelMixin):
     enabled = sa.Column(sa.Boolean(), default=True)
     last_run_at = sa.Column(sa.DateTime(timezone=True))
     total_run_count = sa.Column(sa.Integer(), nullable=False, default=0)
+    # next fire time in UTC, NULL when unknown
+    next_run_at = sa.Column(sa.DateTime(timezone=True), index=True)
+    # spread the runs up to this many seconds after each crontab match, overriding
+    # the `beat_spread_window` setting, 0 disables spreading
+    spread_window = sa.Column(sa.Integer())
+    # one of CATCH_UP_POLICIES, overriding the `beat_catch_up` setting
+    catch_up = sa.Column(sa.String(16))
     # Change the time
     date_changed = sa.Column(sa.DateTime(timezone=True), default=func.now(), onupdate=func.now())
     description = sa.Column(sa.Text(), default="")
@@ -183,9 +396,25 @@ class PeriodicTask(Base, ModelMixin):
         raise ValueError(f"{self.name} schedule is None!")
 
 
+class BeatLease(Base, ModelMixin):
+    """Lease of a beat process taking part in a sharded schedule."""
+
+    __tablename__ = "celery_beat_lease"
+
+    member_id = sa.Column(sa.String(255), primary_key=True)
+    expires_at = sa.Column(sa.DateTime(timezone=True), nullable=False, index=True)
+
+
+listen(CrontabSchedule, "before_insert", CrontabSchedule.set_fingerprint)
+listen(CrontabSchedule, "before_update", CrontabSchedule.set_fingerprint)
 listen(PeriodicTask, "after_insert", PeriodicTaskChanged.update_changed)
 listen(PeriodicTask, "after_delete", PeriodicTaskChanged.update_changed)
 listen(PeriodicTask, "after_update", PeriodicTaskChanged.changed)
+listen(PeriodicTask, "after_delete", PeriodicTaskTombstone.deleted)
+listen(PeriodicTask, "after_update", PeriodicTaskTombstone.renamed)
 listen(CrontabSchedule, "after_insert", PeriodicTaskChanged.update_changed)
 listen(CrontabSchedule, "after_delete", PeriodicTaskChanged.update_changed)
 listen(CrontabSchedule, "after_update", PeriodicTaskChanged.update_changed)
+listen(Session, "before_commit", PeriodicTaskChanged.before_commit)
+listen(Session, "after_commit", PeriodicTaskChanged.after_commit)
+listen(Session, "after_soft_rollback", PeriodicTaskChanged.after_soft_rollback)
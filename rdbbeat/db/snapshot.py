@@ -0,0 +1,122 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+import datetime as dt
+from typing import Any, Iterator, Optional
+
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import select
+
+from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+from rdbbeat.tzcrontab import TzAwareCrontab, crontab_cache
+
+# Rows fetched from the cursor per round-trip while streaming a snapshot.
+SNAPSHOT_YIELD_PER = 1000
+
+SNAPSHOT_COLUMNS = (
+    PeriodicTask.id,
+    PeriodicTask.name,
+    PeriodicTask.task,
+    PeriodicTask.args,
+    PeriodicTask.kwargs,
+    PeriodicTask.queue,
+    PeriodicTask.exchange,
+    PeriodicTask.routing_key,
+    PeriodicTask.priority,
+    PeriodicTask.expires,
+    PeriodicTask.one_off,
+    PeriodicTask.start_time,
+    PeriodicTask.enabled,
+    PeriodicTask.last_run_at,
+    PeriodicTask.total_run_count,
+    PeriodicTask.next_run_at,
+    PeriodicTask.spread_window,
+    PeriodicTask.catch_up,
+    PeriodicTask.date_changed,
+    CrontabSchedule.id.label("crontab_pk"),
+    CrontabSchedule.minute,
+    CrontabSchedule.hour,
+    CrontabSchedule.day_of_week,
+    CrontabSchedule.day_of_month,
+    CrontabSchedule.month_of_year,
+    CrontabSchedule.timezone,
+)
+
+
+class PeriodicTaskSnapshot:
+    """Detached copy of the `PeriodicTask` columns needed by a schedule entry.
+
+    Stands in for the ORM model in `ModelEntry`, without identity map or lazy loads.
+    """
+
+    __slots__ = tuple(column.key for column in SNAPSHOT_COLUMNS) + ("no_changes",)
+
+    id: int
+    name: str
+    task: str
+    args: str
+    kwargs: str
+    queue: Optional[str]
+    exchange: Optional[str]
+    routing_key: Optional[str]
+    priority: Optional[int]
+    expires: Optional[dt.datetime]
+    one_off: bool
+    start_time: Optional[dt.datetime]
+    enabled: bool
+    last_run_at: Optional[dt.datetime]
+    total_run_count: int
+    next_run_at: Optional[dt.datetime]
+    spread_window: Optional[int]
+    catch_up: Optional[str]
+    date_changed: Optional[dt.datetime]
+    crontab_pk: Optional[int]
+    minute: str
+    hour: str
+    day_of_week: str
+    day_of_month: str
+    month_of_year: str
+    timezone: str
+
+    def __init__(self, row: Row) -> None:
+        for key, value in row._mapping.items():
+            setattr(self, key, value)
+        self.no_changes = False
+
+    def __repr__(self) -> str:
+        return f"<PeriodicTaskSnapshot: {self.name}>"
+
+    @property
+    def schedule(self) -> TzAwareCrontab:
+        if self.crontab_pk is None:
+            raise ValueError(f"{self.name} schedule is None!")
+        return crontab_cache.get(
+            minute=self.minute,
+            hour=self.hour,
+            day_of_week=self.day_of_week,
+            day_of_month=self.day_of_month,
+            month_of_year=self.month_of_year,
+            timezone=self.timezone,
+        )
+
+
+def iter_task_snapshots(
+    session: Session, *criteria: Any, yield_per: int = SNAPSHOT_YIELD_PER
+) -> Iterator[PeriodicTaskSnapshot]:
+    """
+    Stream periodic tasks joined with their crontab in a single query.
+
+    :param criteria: filters applied to the query, e.g. `PeriodicTask.enabled.is_(True)`
+    :param yield_per: number of rows buffered from the cursor at a time
+    """
+    query = (
+        select(*SNAPSHOT_COLUMNS)
+        .outerjoin_from(
+            PeriodicTask, CrontabSchedule, PeriodicTask.crontab_id == CrontabSchedule.id
+        )
+        .where(*criteria)
+        .execution_options(stream_results=True)
+    )
+    for row in session.execute(query).yield_per(yield_per):
+        yield PeriodicTaskSnapshot(row)
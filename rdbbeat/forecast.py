@@ -0,0 +1,106 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+"""Forecast of the number of dispatches per minute, to spot thundering herds."""
+
+import datetime as dt
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pytz
+from celery.utils.time import maybe_make_aware
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from rdbbeat.cronmask import CronMask
+from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+from rdbbeat.tzcrontab import crontab_cache
+
+_ONE_MINUTE = dt.timedelta(minutes=1)
+
+
+class FireDensity:
+    """
+    Dispatches per minute over a window, in total, by queue and by crontab id.
+
+    Minutes are timezone aware datetimes in UTC.
+    """
+
+    def __init__(self, start: dt.datetime, end: dt.datetime) -> None:
+        self.start = start
+        self.end = end
+        self.total: Counter = Counter()
+        self.by_queue: Dict[Optional[str], Counter] = defaultdict(Counter)
+        self.by_crontab: Dict[int, Counter] = defaultdict(Counter)
+
+    def add(self, minute: dt.datetime, queue: Optional[str], crontab_id: int, count: int) -> None:
+        self.total[minute] += count
+        self.by_queue[queue][minute] += count
+        self.by_crontab[crontab_id][minute] += count
+
+    @property
+    def peak(self) -> int:
+        """Highest number of dispatches in a single minute."""
+        return max(self.total.values(), default=0)
+
+    def busiest(self, n: int = 10) -> List[Tuple[dt.datetime, int]]:
+        """Return the `n` minutes with the most dispatches, with their count."""
+        return self.total.most_common(n)
+
+
+def fire_times(mask: CronMask, start: dt.datetime, end: dt.datetime) -> Iterator[dt.datetime]:
+    """Yield the fire times of `mask` in [start, end)."""
+    fire = mask.next_fire(start - _ONE_MINUTE)
+    while fire is not None and fire < end:
+        if fire >= start:
+            yield fire
+        fire = mask.next_fire(fire)
+
+
+def fire_density(
+    session: Session,
+    start: Optional[dt.datetime] = None,
+    end: Optional[dt.datetime] = None,
+    window: dt.timedelta = dt.timedelta(days=1),
+) -> FireDensity:
+    """
+    Forecast the dispatches of the enabled periodic tasks per minute in [start, end).
+
+    Fire times are computed once per distinct crontab and weighted by the number of
+    tasks using it on each queue, so the cost does not grow with the number of tasks.
+    `start_time` and one-off tasks are not taken into account.
+
+    :param start: defaults to now, naive datetimes are taken as UTC
+    :param end: defaults to `start` + `window`
+    """
+    start = maybe_make_aware(start or dt.datetime.utcnow()).astimezone(pytz.utc)
+    end = maybe_make_aware(end).astimezone(pytz.utc) if end else start + window
+    density = FireDensity(start, end)
+
+    query = (
+        select(
+            CrontabSchedule.id,
+            CrontabSchedule.minute,
+            CrontabSchedule.hour,
+            CrontabSchedule.day_of_week,
+            CrontabSchedule.day_of_month,
+            CrontabSchedule.month_of_year,
+            CrontabSchedule.timezone,
+            PeriodicTask.queue,
+            func.count(PeriodicTask.id),
+        )
+        .join_from(PeriodicTask, CrontabSchedule, PeriodicTask.crontab_id == CrontabSchedule.id)
+        .where(PeriodicTask.enabled.is_(True))
+        .group_by(CrontabSchedule.id, PeriodicTask.queue)
+    )
+    queues_by_crontab: Dict[Tuple, List[Tuple[Optional[str], int]]] = defaultdict(list)
+    for crontab_id, *fields, queue, count in session.execute(query):
+        queues_by_crontab[(crontab_id, *fields)].append((queue, count))
+
+    for (crontab_id, *fields), queues in queues_by_crontab.items():
+        mask = crontab_cache.get(*fields).mask
+        for fire in fire_times(mask, start, end):
+            minute = fire.astimezone(pytz.utc)
+            for queue, count in queues:
+                density.add(minute, queue, crontab_id, count)
+    return density
@@ -0,0 +1,108 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+import datetime as dt
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RunStateJournal:
+    """
+    Append-only local journal of the run state of schedule entries.
+
+    Each dispatch appends the new `last_run_at`, `total_run_count` and `next_run_at` of
+    the entry, so run states written behind to the database survive a crash of beat. Records
+    hold absolute values, replaying them more than once is harmless.
+    """
+
+    def __init__(self, path: str, fsync: bool = True) -> None:
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(
+        self, records: Iterable[Tuple[int, dt.datetime, int, Optional[dt.datetime]]]
+    ) -> None:
+        """
+        :param records: tuples of (periodic task id, last_run_at, total_run_count, next_run_at)
+        """
+        lines = "".join(_line(*record) for record in records)
+        with self._lock:
+            self._write(lines)
+
+    def _write(self, lines: str) -> None:
+        self._file.write(lines)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def replay(self) -> Dict[int, Dict]:
+        """Return the latest journaled run state by periodic task id."""
+        with self._lock:
+            return self._replay()
+
+    def _replay(self) -> Dict[int, Dict]:
+        states: Dict[int, Dict] = {}
+        with open(self.path, encoding="utf-8") as journal:
+            for number, line in enumerate(journal, start=1):
+                try:
+                    record = json.loads(line)
+                    record["last_run_at"] = dt.datetime.fromisoformat(record["last_run_at"])
+                    # unknown in records written before it was journaled
+                    next_run_at = record.get("next_run_at")
+                    record["next_run_at"] = next_run_at and dt.datetime.fromisoformat(next_run_at)
+                except (ValueError, KeyError, TypeError) as exc:
+                    # a torn write from a crash, the record was never acknowledged
+                    logger.warning("Skipping journal line %d of %s: %r", number, self.path, exc)
+                    continue
+                states[record["id"]] = record
+        return states
+
+    def truncate(self) -> None:
+        """Drop all records, once they are flushed to the database."""
+        with self._lock:
+            self._file.truncate(0)
+            self._write("")
+
+    def discard(self, ids: Iterable[int]) -> None:
+        """Drop the records of the periodic tasks `ids` only, keeping the latest of the others."""
+        ids = set(ids)
+        with self._lock:
+            kept = [state for task_id, state in self._replay().items() if task_id not in ids]
+            self._file.truncate(0)
+            self._write(
+                "".join(
+                    _line(
+                        state["id"],
+                        state["last_run_at"],
+                        state["total_run_count"],
+                        state["next_run_at"],
+                    )
+                    for state in kept
+                )
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _line(
+    task_id: int,
+    last_run_at: dt.datetime,
+    total_run_count: int,
+    next_run_at: Optional[dt.datetime],
+) -> str:
+    record = {
+        "id": task_id,
+        "last_run_at": last_run_at.isoformat(),
+        "total_run_count": total_run_count,
+        "next_run_at": next_run_at.isoformat() if next_run_at else None,
+    }
+    return json.dumps(record) + "\n"
@@ -0,0 +1,218 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Measurements of the `DatabaseScheduler`: name -> (type, help)
+METRICS = {
+    "rdbbeat_tick_duration_seconds": ("histogram", "Duration of a beat tick."),
+    "rdbbeat_reload_duration_seconds": ("histogram", "Duration of a full schedule reload."),
+    "rdbbeat_reload_entries": ("gauge", "Number of entries loaded by the last full reload."),
+    "rdbbeat_schedule_changed_duration_seconds": (
+        "histogram",
+        "Duration of the check for schedule changes.",
+    ),
+    "rdbbeat_sync_duration_seconds": ("histogram", "Duration of a sync to the database."),
+    "rdbbeat_sync_entries": ("histogram", "Number of entries saved by a sync."),
+    "rdbbeat_dispatch_lag_seconds": (
+        "histogram",
+        "Delay between the scheduled fire time and the publication of a task.",
+    ),
+    "rdbbeat_dispatches_total": ("counter", "Number of tasks published."),
+    "rdbbeat_deferrals_total": (
+        "counter",
+        "Number of due tasks deferred to a later tick by the rate limits.",
+    ),
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# How often `PrometheusMetrics.flush` writes the file
+DEFAULT_WRITE_INTERVAL = 15  # seconds
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsSink:
+    """
+    Receiver of the measurements of the `DatabaseScheduler`, see `METRICS`.
+
+    This sink drops them, subclasses record or forward them.
+    """
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        """Add a sample to the histogram `name`."""
+
+    def increment(
+        self, name: str, value: float = 1, labels: Optional[Dict[str, str]] = None
+    ) -> None:
+        """Add `value` to the counter `name`."""
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        """Set the gauge `name` to `value`."""
+
+    @contextmanager
+    def timer(self, name: str, labels: Optional[Dict[str, str]] = None) -> Iterator[None]:
+        """Observe the duration of the block in the histogram `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def flush(self) -> None:
+        """Called at the end of every tick."""
+
+    def close(self) -> None:
+        pass
+
+
+class PrometheusMetrics(MetricsSink):
+    """
+    In-memory metrics exported in the Prometheus text format.
+
+    The metrics are served with `serve` and/or written to `path` by `flush`,
+    at most every `write_interval` seconds, replacing the file atomically
+    (e.g. for the textfile collector of the node exporter).
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        write_interval: float = DEFAULT_WRITE_INTERVAL,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.path = path
+        self.write_interval = write_interval
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # name -> labels -> [bucket counts..., +Inf bucket count, sum]
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}
+        self._values: Dict[str, Dict[Labels, float]] = {}
+        self._last_write: Optional[float] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @staticmethod
+    def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+        return tuple(sorted(labels.items())) if labels else ()
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            sample = series.get(key)
+            if sample is None:
+                sample = series[key] = [0.0] * (len(self.buckets) + 2)
+            # buckets are cumulative when rendered
+            sample[bisect.bisect_left(self.buckets, value)] += 1
+            sample[-1] += value
+
+    def increment(
+        self, name: str, value: float = 1, labels: Optional[Dict[str, str]] = None
+    ) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._values.setdefault(name, {})[self._labels(labels)] = value
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(set(self._histograms) | set(self._values)):
+                kind, help_text = METRICS.get(name, ("untyped", ""))
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                if name in self._histograms:
+                    lines.append(f"# TYPE {name} histogram")
+                    for labels, sample in sorted(self._histograms[name].items()):
+                        cumulative = 0.0
+                        for bound, count in zip(self.buckets + (float("inf"),), sample):
+                            cumulative += count
+                            le = "+Inf" if bound == float("inf") else repr(float(bound))
+                            lines.append(
+                                f"{name}_bucket{_format_labels(labels + (('le', le),))} "
+                                f"{_format_value(cumulative)}"
+                            )
+                        lines.append(f"{name}_sum{_format_labels(labels)} {sample[-1]!r}")
+                        lines.append(
+                            f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}"
+                        )
+                else:
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in sorted(self._values[name].items()):
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Optional[str] = None) -> None:
+        """Write the metrics to `path`, through a temporary file renamed over it."""
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to write the metrics to")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as output:
+            output.write(self.render())
+        os.replace(tmp_path, path)
+        self._last_write = time.monotonic()
+
+    def flush(self) -> None:
+        if self.path is None:
+            return
+        if self._last_write is None or time.monotonic() - self._last_write >= self.write_interval:
+            self.write()
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the metrics over HTTP from a daemon thread, on localhost by default."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(
+            target=self._server.serve_forever, name="rdbbeat-metrics", daemon=True
+        )
+        thread.start()
+        return self._server
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.path is not None:
+            self.write()
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,100 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+import datetime as dt
+from typing import Any, Dict, List, Optional
+
+from celery import Celery, signals
+from celery.app.amqp import task_message
+from celery.result import AsyncResult
+from celery.utils.time import maybe_make_aware
+from kombu.serialization import dumps
+from kombu.utils.uuid import uuid
+
+# stands for the task id in the message template
+_TEMPLATE_ID = "rdbbeat-template-id"
+
+
+class DispatchPayload:
+    """
+    Task message of a schedule entry, routed and serialized once.
+
+    Each send only stamps a new task id, and the AMQP expiration when the entry expires,
+    on copies of the headers and properties. The body is published as is.
+    """
+
+    __slots__ = (
+        "app",
+        "name",
+        "options",
+        "expires",
+        "ignore_result",
+        "headers",
+        "properties",
+        "sent_event",
+        "body",
+        "content_type",
+        "content_encoding",
+    )
+
+    def __init__(
+        self, app: Celery, name: str, args: List, kwargs: Dict, options: Dict[str, Any]
+    ) -> None:
+        self.app = app
+        self.name = name
+        options = dict(options)
+        self.expires: Optional[dt.datetime] = options.pop("expires", None)
+        self.ignore_result: bool = options.pop("ignore_result", False)
+        self.options = app.amqp.router.route(options, name, args, kwargs)
+        headers, properties, body, sent_event = app.amqp.create_task_message(
+            _TEMPLATE_ID,
+            name,
+            args,
+            kwargs,
+            expires=self.expires,
+            reply_to=app.thread_oid,
+            create_sent_event=app.conf.task_send_sent_event,
+            ignore_result=self.ignore_result,
+            **self.options,
+        )
+        self.headers = headers
+        self.properties = properties
+        self.sent_event = sent_event
+        self.content_type, self.content_encoding, self.body = dumps(
+            body, serializer=self.options.get("serializer") or app.conf.task_serializer
+        )
+
+    @staticmethod
+    def usable() -> bool:
+        """Publish signal receivers expect the decoded body, they need the regular path."""
+        return not (
+            signals.before_task_publish.receivers
+            or signals.after_task_publish.receivers
+            or signals.task_sent.receivers
+        )
+
+    def send(self, producer: Any = None, **options: Any) -> AsyncResult:
+        task_id = uuid()
+        headers = dict(self.headers, id=task_id, root_id=task_id)
+        sent_event = None
+        if self.sent_event:
+            sent_event = dict(self.sent_event, uuid=task_id, root_id=task_id)
+        message = task_message(
+            headers, dict(self.properties, correlation_id=task_id), self.body, sent_event
+        )
+
+        options = dict(
+            self.options,
+            content_type=self.content_type,
+            content_encoding=self.content_encoding,
+            **options,
+        )
+        if self.expires is not None:
+            expires = maybe_make_aware(self.expires) - self.app.now()
+            options["expiration"] = max(expires.total_seconds(), 0)
+
+        with self.app.producer_or_acquire(producer) as P:
+            if not self.ignore_result:
+                self.app.backend.on_task_call(P, task_id)
+            self.app.amqp.send_task_message(P, self.name, message, **options)
+        return self.app.AsyncResult(task_id)
@@ -2,24 +2,94 @@
 # Copyright (c) 2023 Hewlett Packard Enterprise Development LP
 # MIT License
 
+import copy
 import datetime as dt
+import heapq
 import logging
+import time
 from multiprocessing.util import Finalize
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
+import pytz
 import sqlalchemy
 from celery import Celery, current_app, schedules
-from celery.beat import ScheduleEntry, Scheduler
+from celery.beat import ScheduleEntry, Scheduler, SchedulingError, event_t
 from celery.utils.time import maybe_make_aware
 from kombu.utils.json import dumps, loads
+from kombu.utils.limits import TokenBucket
+from sqlalchemy.orm.attributes import flag_modified
 
-from rdbbeat.db.models import CrontabSchedule, PeriodicTask, PeriodicTaskChanged
+from rdbbeat.changefeed import ChangeFeed
+from rdbbeat.cronmask import next_fire_times
+from rdbbeat.db.models import (
+    CATCH_UP_COALESCE,
+    CATCH_UP_POLICIES,
+    CATCH_UP_SKIP,
+    CHANGE_LOG,
+    CHANGE_MARKER,
+    CrontabSchedule,
+    PeriodicTask,
+    PeriodicTaskChanged,
+    PeriodicTaskChangeLog,
+    PeriodicTaskTombstone,
+)
+from rdbbeat.db.snapshot import PeriodicTaskSnapshot, iter_task_snapshots
+from rdbbeat.journal import RunStateJournal
+from rdbbeat.metrics import MetricsSink, PrometheusMetrics
+from rdbbeat.payload import DispatchPayload
+from rdbbeat.sharding import DEFAULT_LEASE_TTL, ShardMembership, stable_hash
+from rdbbeat.tzcrontab import NEVER_CHECK_INTERVAL, TzAwareCrontab, crontab_cache
 
 # This scheduler must wake up more frequently than the
 # regular of 5 minutes because it needs to take external
 # changes to the schedule into account.
 DEFAULT_MAX_INTERVAL = 5  # seconds
 
+# With a change feed, changes wake the scheduler up, so it only needs to
+# wake up for due entries and to double check the database now and then.
+DEFAULT_CHANGE_FEED_MAX_INTERVAL = 300  # seconds
+
+# Rows changed this long before the delta reload watermark are fetched again,
+# `date_changed` may only have a resolution of one second (e.g. on SQLite).
+DELTA_RELOAD_OVERLAP = dt.timedelta(seconds=1)
+
+# `date_changed` is set when the writing transaction starts on some databases
+# (`now()` on PostgreSQL), so a transaction committing after a delta reload can be
+# stamped before its watermark. A full reload this often bounds how long it is missed.
+DEFAULT_DELTA_RELOAD_MAX_AGE = 300  # seconds
+
+# Tombstones this much older than the delta reload watermark are pruned by the full
+# reloads. Far longer than the delta reloads of any scheduler last.
+TOMBSTONE_RETENTION = dt.timedelta(days=1)
+
+# How often the change log is pruned down to the lookback window.
+DEFAULT_CHANGE_LOG_PRUNE_INTERVAL = 3600  # seconds
+
+# Sequences are taken when writers start appending, not when they commit, so an entry
+# can appear below the highest sequence already seen. This many sequences below it are
+# read again, and kept by the pruning.
+CHANGE_LOG_LOOKBACK = 1000
+
+# Maximum number of entries sent in one tick in batch dispatch mode.
+DEFAULT_BATCH_MAX_SIZE = 1000
+
+# Runs due for longer than this are missed runs, handled by the catch-up policy.
+DEFAULT_CATCH_UP_GRACE = 60  # seconds
+
+# Missed runs replayed per second, across all tasks.
+DEFAULT_CATCH_UP_RATE = 1
+
 ADD_ENTRY_ERROR = """\
 Cannot add entry %r to database schedule: %r. Contents: %r
 """
@@ -35,7 +105,7 @@ class ModelEntry(ScheduleEntry):
         # (schedule_type, model_type, model_field)
         (schedules.crontab, CrontabSchedule, "crontab"),
     )
-    save_fields = ["last_run_at", "total_run_count", "no_changes"]
+    save_fields = ["last_run_at", "total_run_count", "next_run_at", "no_changes"]
 
     def __init__(
         self,
@@ -53,7 +123,7 @@ class ModelEntry(ScheduleEntry):
         self.task = model.task
 
         try:
-            self.schedule = model.schedule
+            self.schedule = self._spread(model.schedule)
             logger.debug(f"schedule: {self.schedule}")
         except Exception as e:
             logger.error(e)
@@ -91,10 +161,39 @@ class ModelEntry(ScheduleEntry):
         # update tzinfo since it may not be present
         self.last_run_at = self.last_run_at.replace(tzinfo=self.app.timezone)
 
+        # shared by the entries advanced from this one, until the row is reloaded
+        self._payloads: Dict[str, DispatchPayload] = {}
+
+    @property
+    def payload(self) -> DispatchPayload:
+        """Dispatch payload of the entry, built on first use."""
+        payload = self._payloads.get("message")
+        if payload is None:
+            payload = self._payloads["message"] = DispatchPayload(
+                self.app, self.task, self.args, self.kwargs, self.options
+            )
+        return payload
+
+    def _spread(self, schedule: schedules.schedule) -> schedules.schedule:
+        """Offset the crontab by a stable share of the spread window of the task."""
+        window = getattr(self.model, "spread_window", None)
+        if window is None:
+            window = self.app.conf.get("beat_spread_window")
+        if not window or not isinstance(schedule, TzAwareCrontab):
+            return schedule
+        return schedule.with_offset(stable_hash(self.name) % window)
+
     def _disable(self, model: schedules.schedule) -> None:
         model.no_changes = True
         self.model.enabled = self.enabled = model.enabled = False
-        if self.session:
+        if isinstance(model, PeriodicTaskSnapshot):
+            # detached snapshot, only write the flag to its row
+            with self.session_scope() as session:
+                session.query(PeriodicTask).filter_by(id=model.id).update(
+                    {"enabled": False}, synchronize_session=False
+                )
+                session.commit()
+        elif self.session:
             self.session.add(model)
             self.session.commit()
         else:
@@ -102,7 +201,7 @@ class ModelEntry(ScheduleEntry):
                 session.add(model)
                 session.commit()
 
-    def is_due(self) -> bool:
+    def is_due(self) -> schedules.schedstate:
         if not self.model.enabled:
             # 5 second delay for re-enable.
             return schedules.schedstate(False, 5.0)
@@ -129,6 +228,16 @@ class ModelEntry(ScheduleEntry):
 
         return self.schedule.is_due(self.last_run_at)
 
+    def is_plain_crontab(self) -> bool:
+        """Whether `is_due` only depends on the crontab and the last run time."""
+        model = self.model
+        return (
+            isinstance(getattr(self, "schedule", None), TzAwareCrontab)
+            and model.enabled
+            and model.start_time is None
+            and not (model.one_off and model.total_run_count > 0)
+        )
+
     def _default_now(self) -> dt.datetime:
         now = self.app.now()
         # The PyTZ datetime must be localised for the scheduler to work
@@ -139,10 +248,21 @@ class ModelEntry(ScheduleEntry):
 
     def __next__(self) -> ScheduleEntry:
         # should be use `self._default_now()` or `self.app.now()` ?
-        self.model.last_run_at = self.app.now()
+        # a replayed run only advances to the fire time it stands for
+        self.model.last_run_at = self.__dict__.pop("replay_at", None) or self.app.now()
         self.model.total_run_count += 1
         self.model.no_changes = True
-        return self.__class__(self.model, self.session_scope)
+        schedule = getattr(self, "schedule", None)
+        if isinstance(schedule, TzAwareCrontab):
+            self.model.next_run_at = schedule.next_run_at(self.model.last_run_at)
+        # Carry over the decoded arguments, options and compiled schedule,
+        # only the run state changes.
+        entry = self.__class__.__new__(self.__class__)
+        entry.__dict__.update(self.__dict__)
+        entry.total_run_count = self.model.total_run_count
+        entry.enabled = self.model.enabled
+        entry.last_run_at = self.model.last_run_at.replace(tzinfo=self.app.timezone)
+        return entry
 
     next = __next__  # for 2to3
 
@@ -159,9 +279,56 @@ class ModelEntry(ScheduleEntry):
                 setattr(obj, field, getattr(self.model, field))
             for field in fields:
                 setattr(obj, field, getattr(self.model, field))
+            if self.model.no_changes:
+                # keep `date_changed`, run states are not changes to the schedule
+                flag_modified(obj, "date_changed")
             session.add(obj)
             session.commit()
 
+    @classmethod
+    def save_many(
+        cls,
+        session_scope: sqlalchemy.orm.Session,
+        entries: List["ModelEntry"],
+        fields: Tuple = tuple(),
+    ) -> None:
+        """Save the run state of many entries in one transaction.
+
+        :params fields: tuple, the additional fields to save
+        """
+        table = PeriodicTask.__table__
+        columns = [field for field in (*cls.save_fields, *fields) if field in table.c]
+        cls.save_rows(
+            session_scope,
+            [
+                {
+                    "id": entry.model.id,
+                    **{column: getattr(entry.model, column) for column in columns},
+                }
+                for entry in entries
+            ],
+        )
+
+    @classmethod
+    def save_rows(cls, session_scope: sqlalchemy.orm.Session, rows: List[Dict]) -> None:
+        """Write rows of `PeriodicTask` columns by id, with a single executemany UPDATE.
+
+        The mapper listeners do not fire and `date_changed` is kept, so the schedule is
+        not marked as changed. All rows must have the same keys.
+        """
+        if not rows:
+            return
+        table = PeriodicTask.__table__
+        values = {column: sqlalchemy.bindparam(column) for column in rows[0] if column != "id"}
+        statement = (
+            table.update()
+            .where(table.c.id == sqlalchemy.bindparam("_id"))
+            .values(dict(values, date_changed=table.c.date_changed))
+        )
+        with session_scope() as session:
+            session.execute(statement, [dict(row, _id=row["id"]) for row in rows])
+            session.commit()
+
     @classmethod
     def to_model_schedule(
         cls, session: sqlalchemy.orm.Session, schedule: schedules.schedule
@@ -269,10 +436,22 @@ class DatabaseScheduler(Scheduler):
     Model = PeriodicTask
     Changes = PeriodicTaskChanged
 
-    _schedule = None
+    _schedule: Optional[Dict[str, ModelEntry]] = None
+    # set to None by `Scheduler.__init__`, built by `populate_heap`
+    _heap: Optional[List[Any]] = None
+    # the schedule `populate_heap` last ran against
+    old_schedulers: Optional[Dict[str, ModelEntry]] = None
     _last_timestamp = None
+    _last_sequence: Optional[int] = None
+    _seen_sequences: FrozenSet[int] = frozenset()
+    _last_prune = None
+    _last_date_changed = None
+    _last_full_reload: Optional[float] = None
+    _last_poll: Optional[float] = None
+    _last_heartbeat = None
     _initial_read = True
     _heap_invalidated = False
+    _heap_patched = False
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         """Initialize the database scheduler."""
@@ -280,37 +459,415 @@ class DatabaseScheduler(Scheduler):
         self.session_scope: sqlalchemy.Session = kwargs.get("session_scope") or self.app.conf.get(
             "session_scope"
         )
+        # Patch the schedule with changed rows only, instead of rebuilding every entry.
+        self.delta_reload: bool = kwargs.get("delta_reload") or self.app.conf.get(
+            "beat_delta_reload", False
+        )
+        self.delta_reload_max_age: float = (
+            kwargs.get("delta_reload_max_age")
+            or self.app.conf.get("beat_delta_reload_max_age")
+            or DEFAULT_DELTA_RELOAD_MAX_AGE
+        )
+        self.change_feed: Optional[ChangeFeed] = kwargs.get("change_feed") or self.app.conf.get(
+            "beat_change_feed"
+        )
+        self.change_tracking: str = (
+            kwargs.get("change_tracking")
+            or self.app.conf.get("beat_change_tracking")
+            or self.Changes.tracking
+        )
+        if self.change_tracking not in (CHANGE_MARKER, CHANGE_LOG):
+            raise ValueError(f"Unknown change tracking backend {self.change_tracking!r}")
+        if self.change_tracking != self.Changes.tracking:
+            # the writers of this process would not be seen
+            raise ValueError(
+                f"Change tracking backend {self.change_tracking!r} does not match the "
+                f"{self.Changes.tracking!r} backend of the writers, "
+                f"set {self.Changes.__name__}.tracking to the same"
+            )
+        self.change_log_prune_interval = (
+            kwargs.get("change_log_prune_interval")
+            or self.app.conf.get("beat_change_log_prune_interval")
+            or DEFAULT_CHANGE_LOG_PRUNE_INTERVAL
+        )
+        # Batch dispatch mode: send all the entries due in a tick together.
+        self.batch_dispatch: bool = kwargs.get("batch_dispatch") or self.app.conf.get(
+            "beat_batch_dispatch", False
+        )
+        self.batch_max_size: int = (
+            kwargs.get("batch_max_size")
+            or self.app.conf.get("beat_batch_max_size")
+            or DEFAULT_BATCH_MAX_SIZE
+        )
+        # Payload cache: route and serialize the message of each entry once per reload.
+        self.payload_cache: bool = kwargs.get("payload_cache") or self.app.conf.get(
+            "beat_payload_cache", False
+        )
+        # Catch-up policy for the runs missed while beat was down, see `is_due`.
+        self.catch_up: str = (
+            kwargs.get("catch_up") or self.app.conf.get("beat_catch_up") or CATCH_UP_COALESCE
+        )
+        if self.catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy {self.catch_up!r}")
+        self.catch_up_grace = dt.timedelta(
+            seconds=kwargs.get("catch_up_grace")
+            or self.app.conf.get("beat_catch_up_grace")
+            or DEFAULT_CATCH_UP_GRACE
+        )
+        catch_up_rate = (
+            kwargs.get("catch_up_rate")
+            or self.app.conf.get("beat_catch_up_rate")
+            or DEFAULT_CATCH_UP_RATE
+        )
+        self.catch_up_bucket = TokenBucket(catch_up_rate, capacity=max(catch_up_rate, 1))
+        # only the runs due before beat started were missed, later ones are just late
+        self._started_at: dt.datetime = self.app.now()
+        # Rate limits: dispatches per second overall and by queue, excess entries wait.
+        rate_limit = kwargs.get("rate_limit") or self.app.conf.get("beat_rate_limit")
+        self.rate_limit_bucket: Optional[TokenBucket] = (
+            TokenBucket(rate_limit, capacity=max(rate_limit, 1)) if rate_limit else None
+        )
+        queue_rate_limits = (
+            kwargs.get("queue_rate_limits") or self.app.conf.get("beat_queue_rate_limits") or {}
+        )
+        self.queue_rate_limit_buckets: Dict[str, TokenBucket] = {
+            queue: TokenBucket(rate, capacity=max(rate, 1))
+            for queue, rate in queue_rate_limits.items()
+        }
+        # Horizon mode: only keep the entries due within the next `horizon` seconds in memory.
+        self.horizon: Optional[float] = kwargs.get("horizon") or self.app.conf.get("beat_horizon")
+        self._horizon_end: Optional[dt.datetime] = None
+        crontab_cache_size = kwargs.get("crontab_cache_size") or self.app.conf.get(
+            "beat_crontab_cache_size"
+        )
+        if crontab_cache_size is not None:
+            crontab_cache.resize(crontab_cache_size)
+        # Write-behind mode: journal run states locally, flush them every `sync_every` seconds.
+        journal_path = kwargs.get("journal_path") or self.app.conf.get("beat_journal_path")
+        self.journal = RunStateJournal(journal_path) if journal_path else None
+        if self.journal is not None:
+            self.sync_every: float = (
+                kwargs.get("journal_flush_interval")
+                or self.app.conf.get("beat_journal_flush_interval")
+                or self.sync_every
+            )
+        # Sharded mode: only schedule the tasks hashed to this member.
+        self.membership: Optional[ShardMembership] = kwargs.get("membership")
+        if self.membership is None and self.app.conf.get("beat_sharding"):
+            self.membership = ShardMembership(
+                self.session_scope,
+                member_id=self.app.conf.get("beat_shard_member_id"),
+                lease_ttl=self.app.conf.get("beat_shard_lease_ttl") or DEFAULT_LEASE_TTL,
+            )
+        self.metrics: MetricsSink = kwargs.get("metrics") or self.app.conf.get("beat_metrics")
+        if self.metrics is None:
+            metrics_port = self.app.conf.get("beat_metrics_port")
+            metrics_path = self.app.conf.get("beat_metrics_path")
+            if metrics_port or metrics_path:
+                self.metrics = PrometheusMetrics(path=metrics_path)
+                if metrics_port:
+                    self.metrics.serve(
+                        metrics_port, host=self.app.conf.get("beat_metrics_host") or "127.0.0.1"
+                    )
+            else:
+                self.metrics = MetricsSink()
+        # dispatch metrics are labelled by queue, per task labels grow with the schedule
+        self.metrics_per_task: bool = bool(
+            kwargs.get("metrics_per_task") or self.app.conf.get("beat_metrics_per_task")
+        )
         self._dirty: Set[Any] = set()
         Scheduler.__init__(self, *args, **kwargs)
         self._finalize = Finalize(self, self.sync, exitpriority=5)
         self.max_interval = (
             kwargs.get("max_interval")
             or self.app.conf.beat_max_loop_interval
-            or DEFAULT_MAX_INTERVAL
+            or (DEFAULT_CHANGE_FEED_MAX_INTERVAL if self.change_feed else DEFAULT_MAX_INTERVAL)
         )
+        if self.membership is not None:
+            # wake up in time to renew the lease
+            self.max_interval = min(self.max_interval, self.membership.heartbeat_interval)
+        if self.horizon:
+            # wake up in time to slide the horizon
+            self.max_interval = min(self.max_interval, self.horizon / 2)
 
     def setup_schedule(self) -> None:
         """override"""
         logger.info("setup_schedule")
+        if self.journal is not None:
+            self.replay_journal(self.journal)
         self.install_default_entries(self.schedule)
         self.update_from_dict(self.app.conf.beat_schedule)
 
+    def replay_journal(self, journal: RunStateJournal) -> None:
+        """Write the run states journaled before a crash to the database."""
+        states = journal.replay()
+        if states:
+            logger.info("DatabaseScheduler: Replaying %d journaled run states", len(states))
+            self.Entry.save_rows(self.session_scope, list(states.values()))
+        journal.truncate()
+
     def all_as_schedule(self) -> Dict:
         logger.debug("DatabaseScheduler: Fetching database schedule")
-        with self.session_scope() as session:
-            # get all enabled PeriodicTask
-            models = session.query(self.Model).filter_by(enabled=True).all()
+        self._last_full_reload = time.monotonic()
+        reload_timer = self.metrics.timer("rdbbeat_reload_duration_seconds")
+        with reload_timer, self.session_scope() as session:
+            # get all enabled PeriodicTask, joined with their crontab in one query
             s = {}
-            for model in models:
+            criteria = [self.Model.enabled.is_(True)]
+            if self.horizon:
+                self._horizon_end = self._next_horizon_end()
+                criteria.append(self._within_horizon())
+            for model in iter_task_snapshots(session, *criteria):
+                self._track_date_changed(model.date_changed)
+                if not self._owns(model.name):
+                    continue
                 try:
                     s[model.name] = self.Entry(
-                        model, app=self.app, session_scope=self.session_scope, session=session
+                        model, app=self.app, session_scope=self.session_scope
                     )
                 except ValueError:
                     pass
-            return s
+            if self._last_date_changed is not None:
+                PeriodicTaskTombstone.prune(
+                    session, before=self._last_date_changed - TOMBSTONE_RETENTION
+                )
+        self.metrics.set("rdbbeat_reload_entries", len(s))
+        return s
+
+    def delta_schedule(self) -> Tuple[Dict, Set[str]]:
+        """Patch the current schedule in place with rows changed since the last reload.
+
+        Only rows whose ``date_changed`` is at or past the stored watermark are read.
+        Those disabled, out of the horizon or of the shard are removed, as well as the
+        deleted and renamed tasks found in the tombstones.
+
+        :returns: tuple of (changed entries by name, removed names)
+        """
+        logger.debug("DatabaseScheduler: Fetching changed database schedule")
+        assert self._schedule is not None
+        changed = {}
+        removed = set()
+        with self.session_scope() as session:
+            watermark = None
+            criteria = []
+            if self._last_date_changed is not None:
+                watermark = self._last_date_changed - DELTA_RELOAD_OVERLAP
+                criteria.append(self.Model.date_changed >= watermark)
+            for model in iter_task_snapshots(session, *criteria):
+                self._track_date_changed(model.date_changed)
+                if not model.enabled or not self._owns(model.name) or self._past_horizon(model):
+                    removed.add(model.name)
+                    continue
+                try:
+                    changed[model.name] = self.Entry(
+                        model, app=self.app, session_scope=self.session_scope
+                    )
+                except ValueError:
+                    removed.add(model.name)
+            for name, deleted_at in PeriodicTaskTombstone.since(session, watermark):
+                self._track_date_changed(deleted_at)
+                if name not in changed:
+                    removed.add(name)
+
+        removed &= set(self._schedule)
+        for name in removed:
+            del self._schedule[name]
+        self._schedule.update(changed)
+        return changed, removed
+
+    def horizon_schedule(self) -> Tuple[Dict, Set[str]]:
+        """Slide the horizon window forward.
+
+        Entries whose next run entered the window are loaded, entries whose next run
+        moved past it are dropped, except the ones with run states not saved yet.
+
+        :returns: tuple of (loaded entries by name, removed names)
+        """
+        assert self._schedule is not None
+        start, end = self._horizon_end, self._next_horizon_end()
+        logger.debug("DatabaseScheduler: Sliding the horizon to %s", end)
+        loaded = {}
+        with self.session_scope() as session:
+            criteria = [
+                self.Model.enabled.is_(True),
+                self.Model.next_run_at > start,
+                self.Model.next_run_at <= end,
+            ]
+            for model in iter_task_snapshots(session, *criteria):
+                if model.name in self._schedule or not self._owns(model.name):
+                    continue
+                try:
+                    loaded[model.name] = self.Entry(
+                        model, app=self.app, session_scope=self.session_scope
+                    )
+                except ValueError:
+                    pass
+
+        removed = set()
+        for name, entry in self._schedule.items():
+            next_run_at = getattr(entry.model, "next_run_at", None)
+            if name not in self._dirty and next_run_at and maybe_make_aware(next_run_at) > end:
+                removed.add(name)
+        for name in removed:
+            del self._schedule[name]
+        self._schedule.update(loaded)
+        self._horizon_end = end
+        return loaded, removed
+
+    def _next_horizon_end(self) -> dt.datetime:
+        assert self.horizon is not None
+        return self.app.now().astimezone(pytz.utc) + dt.timedelta(seconds=self.horizon)
+
+    def _full_reload_due(self) -> bool:
+        """Whether delta reloads have been used for longer than `delta_reload_max_age`."""
+        return (
+            self.delta_reload
+            and self._last_full_reload is not None
+            and time.monotonic() - self._last_full_reload >= self.delta_reload_max_age
+        )
+
+    def _past_horizon(self, model: PeriodicTaskSnapshot) -> bool:
+        return (
+            bool(self.horizon)
+            and self._horizon_end is not None
+            and model.next_run_at is not None
+            and maybe_make_aware(model.next_run_at) > self._horizon_end
+        )
+
+    def _within_horizon(self) -> Any:
+        # tasks with an unknown next run are always loaded
+        return sqlalchemy.or_(
+            self.Model.next_run_at.is_(None), self.Model.next_run_at <= self._horizon_end
+        )
+
+    def _horizon_due(self) -> bool:
+        """Whether less than half of the horizon is left ahead."""
+        if not self.horizon or self._horizon_end is None:
+            return False
+        remaining = self._horizon_end - self.app.now().astimezone(pytz.utc)
+        return remaining.total_seconds() < self.horizon / 2
+
+    def _owns(self, name: str) -> bool:
+        return self.membership is None or self.membership.owns(name)
+
+    def _shard_changed(self) -> bool:
+        """Renew the shard lease when due, return whether the shard members changed."""
+        if self.membership is None:
+            return False
+        if time.monotonic() - (self._last_heartbeat or 0) < self.membership.heartbeat_interval:
+            return False
+        self._last_heartbeat = time.monotonic()
+        return self.membership.heartbeat()
+
+    def _track_date_changed(self, date_changed: Optional[dt.datetime]) -> None:
+        if date_changed is not None and (
+            self._last_date_changed is None or date_changed > self._last_date_changed
+        ):
+            self._last_date_changed = date_changed
+
+    def _patch_heap(self, changed: Dict, removed: Set[str]) -> None:
+        """Replace only the heap events of changed and removed entries."""
+        if self._heap is None:
+            return
+        stale = removed | set(changed)
+        heap = [event for event in self._heap if event[2].name not in stale]
+        heap.extend(self._heap_events(changed.values()))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._heap_patched = True
+
+    def populate_heap(self, event_t: Any = event_t, heapify: Any = heapq.heapify) -> None:
+        """override
+
+        Plain crontab entries are evaluated together in one batch.
+        """
+        self._heap = list(self._heap_events(self.schedule.values(), event_t=event_t))
+        heapify(self._heap)
+
+    def _heap_events(self, entries: Iterable[ModelEntry], event_t: Any = event_t) -> Iterator:
+        priority = 5
+        batch = []
+        for entry in entries:
+            if entry.is_plain_crontab():
+                batch.append(entry)
+                continue
+            is_due, next_call_delay = entry.is_due()
+            yield event_t(self._when(entry, 0 if is_due else next_call_delay) or 0, priority, entry)
+
+        now = self.app.now()
+        next_fires = next_fire_times(
+            (entry.schedule.mask, entry.last_run_at - entry.schedule.offset) for entry in batch
+        )
+        for entry, next_fire in zip(batch, next_fires):
+            if next_fire is None:
+                next_call_delay = NEVER_CHECK_INTERVAL
+            else:
+                next_fire += entry.schedule.offset
+                next_call_delay = max((next_fire - now).total_seconds(), 0)
+            yield event_t(self._when(entry, next_call_delay) or 0, priority, entry)
+
+    def is_due(self, entry: ScheduleEntry) -> schedules.schedstate:
+        """override
+
+        Apply the catch-up policy to entries whose run was due before beat started, for
+        longer than the grace period, i.e. missed while beat was down. Runs falling behind
+        while beat is up are sent as usual. "coalesce" runs them once, "skip" drops
+        the missed runs and waits for the next one, "replay" runs every missed fire time
+        in turn, at most `catch_up_rate` runs per second across all tasks.
+        """
+        is_due, next_time_to_run = entry.is_due()
+        if not is_due:
+            return schedules.schedstate(is_due, next_time_to_run)
+        policy = getattr(entry.model, "catch_up", None) or self.catch_up
+        if policy == CATCH_UP_COALESCE:
+            return schedules.schedstate(is_due, next_time_to_run)
+        fire_time = self._fire_time(entry)
+        if (
+            fire_time is None
+            or fire_time >= self._started_at
+            or self.app.now() - fire_time <= self.catch_up_grace
+        ):
+            return schedules.schedstate(is_due, next_time_to_run)
+
+        if policy == CATCH_UP_SKIP:
+            self._skip_missed(entry)
+            return entry.is_due()
+        if not self.catch_up_bucket.can_consume():
+            return schedules.schedstate(False, self.catch_up_bucket.expected_time())
+        logger.info("DatabaseScheduler: Replaying run of %s missed at %s", entry.name, fire_time)
+        entry.replay_at = fire_time.astimezone(self.app.timezone)
+        return schedules.schedstate(True, self.catch_up_bucket.expected_time())
+
+    def _skip_missed(self, entry: ModelEntry) -> None:
+        """Advance an entry to now without running it."""
+        logger.info("DatabaseScheduler: Skipping missed runs of %s", entry.name)
+        model = entry.model
+        model.last_run_at = self.app.now()
+        model.next_run_at = entry.schedule.next_run_at(model.last_run_at)
+        model.no_changes = True
+        entry.last_run_at = model.last_run_at.replace(tzinfo=self.app.timezone)
+        self._dirty.add(entry.name)
+        if self.journal is not None:
+            self.journal.append(
+                [(model.id, model.last_run_at, model.total_run_count, model.next_run_at)]
+            )
 
     def schedule_changed(self) -> bool:
+        if self.change_feed is None:
+            with self.metrics.timer("rdbbeat_schedule_changed_duration_seconds"):
+                return self._last_update_changed()
+        # only query the database when notified, or as a fallback every `max_interval`
+        notified = self.change_feed.poll()
+        if not notified and time.monotonic() - (self._last_poll or 0) < self.max_interval:
+            return False
+        self._last_poll = time.monotonic()
+        with self.metrics.timer("rdbbeat_schedule_changed_duration_seconds"):
+            changed = self._last_update_changed()
+        return changed or notified
+
+    def _last_update_changed(self) -> bool:
+        if self.change_tracking == CHANGE_LOG:
+            return self._change_log_advanced()
         with self.session_scope() as session:
             changes = session.query(self.Changes).get(1)
             if not changes:
@@ -327,39 +884,296 @@ class DatabaseScheduler(Scheduler):
                 self._last_timestamp = ts
             return False
 
+    def _change_log_advanced(self) -> bool:
+        """Whether entries were appended to the change log since the last check.
+
+        The sequences within `CHANGE_LOG_LOOKBACK` of the highest one are compared with
+        the ones seen, so entries committed after later sequences are not missed.
+        """
+        with self.session_scope() as session:
+            initial = self._last_sequence is None
+            if self._last_sequence is None:
+                cursor = PeriodicTaskChangeLog.last_sequence(session) or 0
+            else:
+                cursor = self._last_sequence
+            sequences = PeriodicTaskChangeLog.sequences_after(session, cursor - CHANGE_LOG_LOOKBACK)
+            appended = sequences - self._seen_sequences
+            self._last_sequence = sequence = max(sequences, default=cursor)
+            self._seen_sequences = frozenset(
+                seq for seq in sequences if seq > sequence - CHANGE_LOG_LOOKBACK
+            )
+            if sequence and (
+                self._last_prune is None
+                or time.monotonic() - self._last_prune >= self.change_log_prune_interval
+            ):
+                # keep the lookback window, so late entries and the highest sequence remain
+                pruned = PeriodicTaskChangeLog.prune(
+                    session, before=sequence - CHANGE_LOG_LOOKBACK + 1
+                )
+                self._last_prune = time.monotonic()
+                if pruned:
+                    logger.debug("DatabaseScheduler: Pruned %d change log entries", pruned)
+        return not initial and bool(appended)
+
+    def tick(self, *args: Any, **kwargs: Any) -> float:
+        """override
+
+        With a change feed, sleep until the next entry is due or a change is announced.
+        In batch dispatch mode, send all the due entries at once.
+        """
+        with self.metrics.timer("rdbbeat_tick_duration_seconds"):
+            if self.batch_dispatch:
+                interval = self.tick_batch()
+            elif self.rate_limit_bucket is not None or self.queue_rate_limit_buckets:
+                interval = self._tick_due(1, self.apply_each)
+            else:
+                interval = super().tick(*args, **kwargs)
+        self.metrics.flush()
+        if self.change_feed is None or not interval or interval <= 0:
+            return interval
+        if self.change_feed.wait(interval):
+            logger.debug("DatabaseScheduler: Woken up by a schedule change")
+        if self.should_sync():
+            self._do_sync()
+        return 0
+
+    def tick_batch(self) -> float:
+        """Run a tick sending every entry due, up to `batch_max_size`, in one batch."""
+        return self._tick_due(self.batch_max_size, self.apply_entries)
+
+    def _tick_due(self, max_size: int, send: Callable[[List[ModelEntry]], None]) -> float:
+        """Reserve up to `max_size` due entries and `send` them.
+
+        Entries over the rate limits are set aside and pushed back unchanged, so they
+        keep their place in due-time order without holding back the other queues.
+        """
+        if self._heap is None or not self.schedules_equal(self.old_schedulers, self.schedule):
+            self.old_schedulers = copy.copy(self.schedule)
+            self.populate_heap()
+
+        heap = self._heap
+        assert heap is not None
+        due: List[Tuple[Any, float]] = []
+        deferred = []
+        # seconds until something can be sent, when nothing is
+        waits = [self.max_interval]
+        while heap and len(due) < max_size:
+            is_due, next_time_to_run = self.is_due(heap[0].entry)
+            if not is_due:
+                waits.append(self.adjust(next_time_to_run))
+                break
+            event = heapq.heappop(heap)
+            delay = self.throttle(event.entry)
+            if delay:
+                deferred.append((event, delay))
+                waits.append(delay)
+                if self.rate_limit_bucket is not None and self.rate_limit_bucket.expected_time():
+                    # nothing else can be sent before the global bucket refills
+                    break
+                continue
+            due.append((event, next_time_to_run))
+        if deferred:
+            self._defer(heap, deferred)
+        if not due:
+            return min(wait for wait in waits if isinstance(wait, (int, float)))
+
+        next_entries = self.reserve_many([event.entry for event, _ in due])
+        send([event.entry for event, _ in due])
+        for (event, next_time_to_run), next_entry in zip(due, next_entries):
+            when = self._when(next_entry, next_time_to_run)
+            heapq.heappush(heap, event_t(when, event.priority, next_entry))
+        return 0
+
+    def apply_each(self, entries: List[ModelEntry]) -> None:
+        """Send entries one by one, with the retry policy."""
+        for entry in entries:
+            self.apply_entry(entry, producer=self.producer)
+
+    def _queue(self, entry: ScheduleEntry) -> str:
+        return entry.options.get("queue") or self.app.conf.task_default_queue
+
+    def throttle(self, entry: ScheduleEntry) -> float:
+        """Take a token for `entry` from the global and queue buckets.
+
+        :returns: 0 when taken, otherwise the seconds until both buckets have one
+        """
+        queue = self._queue(entry)
+        buckets = [
+            bucket
+            for bucket in (self.rate_limit_bucket, self.queue_rate_limit_buckets.get(queue))
+            if bucket is not None
+        ]
+        delay = max((bucket.expected_time() for bucket in buckets), default=0)
+        if delay:
+            return delay
+        for bucket in buckets:
+            bucket.can_consume()
+        return 0
+
+    def _defer(self, heap: List[Any], deferred: List[Tuple[Any, float]]) -> None:
+        """Push entries over the rate limits back, with their due time."""
+        logger.info("DatabaseScheduler: Deferred %d due tasks over the rate limits", len(deferred))
+        for event, _ in deferred:
+            queue = self._queue(event.entry)
+            logger.debug("DatabaseScheduler: Deferred %s on queue %s", event.entry.name, queue)
+            self.metrics.increment("rdbbeat_deferrals_total", labels={"queue": queue})
+            heapq.heappush(heap, event)
+
+    def apply_entries(self, entries: List[ModelEntry]) -> None:
+        """Send entries over the held producer, connecting once for the whole batch.
+
+        Messages are published without the retry policy, only the entries that fail
+        are sent again with it.
+        """
+        logger.info("DatabaseScheduler: Sending %d due tasks", len(entries))
+        self._ensure_connected()
+        producer = self.producer
+        for entry in entries:
+            logger.debug("Scheduler: Sending due task %s (%s)", entry.name, entry.task)
+            fire_time = self._fire_time(entry)
+            try:
+                self.send_entry(entry, producer, retry=False)
+            except Exception as exc:
+                logger.warning("Retrying to send %s: %r", entry.name, exc)
+                self.apply_entry(entry, producer=producer)
+            else:
+                self._dispatched(entry, fire_time)
+        self._tasks_since_sync += len(entries)
+        if self.should_sync():
+            self._do_sync()
+
+    def send_entry(self, entry: ModelEntry, producer: Any = None, **options: Any) -> Any:
+        """Send the message of an entry, from its cached payload when enabled.
+
+        Tasks registered in the beat app keep going through their own `apply_async`.
+        """
+        task = self.app.tasks.get(entry.task)
+        if task:
+            return task.apply_async(
+                entry.args, entry.kwargs, **dict(entry.options, producer=producer, **options)
+            )
+        if self.payload_cache and DispatchPayload.usable():
+            return entry.payload.send(producer, **options)
+        return self.send_task(
+            entry.task,
+            entry.args,
+            entry.kwargs,
+            **dict(entry.options, producer=producer, **options),
+        )
+
+    def apply_async(
+        self, entry: ScheduleEntry, producer: Any = None, advance: bool = True, **kwargs: Any
+    ) -> Any:
+        """override
+
+        Send through `send_entry`, so the payload cache is used, and record the dispatch.
+        """
+        fire_time = self._fire_time(entry)
+        entry = self.reserve(entry) if advance else entry
+        try:
+            result = self.send_entry(entry, producer)
+        except Exception as exc:
+            raise SchedulingError(f"Couldn't apply scheduled task {entry.name}: {exc}") from exc
+        finally:
+            self._tasks_since_sync += 1
+            if self.should_sync():
+                self._do_sync()
+        self._dispatched(entry, fire_time)
+        return result
+
+    def _fire_time(self, entry: ScheduleEntry) -> Optional[dt.datetime]:
+        """Time a due entry was scheduled to fire at, before it is reserved."""
+        schedule = getattr(entry, "schedule", None)
+        if not isinstance(schedule, TzAwareCrontab):
+            return None
+        return schedule.next_run_at(entry.last_run_at)
+
+    def _dispatched(self, entry: ScheduleEntry, fire_time: Optional[dt.datetime]) -> None:
+        labels = {"queue": self._queue(entry)}
+        if self.metrics_per_task:
+            labels["task"] = entry.name
+        self.metrics.increment("rdbbeat_dispatches_total", labels=labels)
+        if fire_time is not None:
+            lag = (dt.datetime.now(pytz.utc) - fire_time).total_seconds()
+            self.metrics.observe("rdbbeat_dispatch_lag_seconds", max(lag, 0), labels)
+
+    def close(self) -> None:
+        super().close()
+        if self.change_feed is not None:
+            self.change_feed.close()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.membership is not None:
+            self.membership.leave()
+        self.metrics.close()
+
     def reserve(self, entry: ScheduleEntry) -> ScheduleEntry:
         """override
 
         It will be called in parent class.
         """
-        new_entry = next(entry)
+        return self.reserve_many([entry])[0]
+
+    def reserve_many(self, entries: List[ScheduleEntry]) -> List[ScheduleEntry]:
+        """Advance many entries, journaling their run states with a single write."""
+        new_entries = [next(entry) for entry in entries]
         # Need to store entry by name, because the entry may change
         # in the mean time.
-        self._dirty.add(new_entry.name)
-        return new_entry
+        self._dirty.update(entry.name for entry in new_entries)
+        if self.journal is not None:
+            self.journal.append(
+                (
+                    entry.model.id,
+                    entry.model.last_run_at,
+                    entry.model.total_run_count,
+                    entry.model.next_run_at,
+                )
+                for entry in new_entries
+            )
+        return new_entries
 
     def sync(self) -> None:
         """override"""
         logger.info("Writing entries...")
-        _tried = set()
-        _failed = set()
+        _failed: Set[str] = set()
+        _error = False
+        entries = []
+        schedule = self._schedule or {}
+        while self._dirty:
+            name = self._dirty.pop()
+            try:
+                entries.append(schedule[name])
+            except KeyError as exc:
+                logger.error(exc)
+                _failed.add(name)
+        self.metrics.observe("rdbbeat_sync_entries", len(entries))
+        sync_timer = self.metrics.timer("rdbbeat_sync_duration_seconds")
         try:
-            while self._dirty:
-                name = self._dirty.pop()
-                try:
-                    self.schedule[name].save()  # save to database
-                    logger.debug(f"{name} save to database")
-                    _tried.add(name)
-                except KeyError as exc:
-                    logger.error(exc)
-                    _failed.add(name)
-        except sqlalchemy.exc.IntegrityError as exc:
-            logger.exception("Database error while sync: %r", exc)
+            with sync_timer:
+                if entries:
+                    self.Entry.save_many(self.session_scope, entries)  # save to database
+                    logger.debug(f"{len(entries)} entries saved to database")
         except Exception as exc:
-            logger.exception(exc)
+            # isolate the failing rows by saving the entries one by one
+            logger.exception("Database error while sync: %r", exc)
+            for entry in entries:
+                try:
+                    entry.save()
+                except Exception as exc:
+                    logger.exception("Database error while saving %s: %r", entry.name, exc)
+                    _failed.add(entry.name)
+                    _error = True
         finally:
             # retry later, only for the failed ones
             self._dirty |= _failed
+        if self.journal is not None and not _error:
+            if _failed:
+                # entries no longer scheduled, keep their journaled run states
+                self.journal.discard(entry.model.id for entry in entries)
+            else:
+                # everything journaled so far is in the database
+                self.journal.truncate()
 
     def update_from_dict(self, mapping: Dict) -> None:
         s = {}
@@ -371,7 +1185,7 @@ class DatabaseScheduler(Scheduler):
                 entry = self.Entry.from_entry(
                     name, session_scope=self.session_scope, app=self.app, **entry_fields
                 )
-                if entry.model.enabled:
+                if entry.model.enabled and self._owns(name):
                     s[name] = entry
             except Exception as exc:
                 logger.error(ADD_ENTRY_ERROR, name, exc, entry_fields)
@@ -396,31 +1210,50 @@ class DatabaseScheduler(Scheduler):
         if self._heap_invalidated:
             self._heap_invalidated = False
             return False
+        if self._heap_patched:
+            # the heap already reflects the new schedule, only remember it
+            self._heap_patched = False
+            self.old_schedulers = copy.copy(args[1])
+            return True
         return super(DatabaseScheduler, self).schedules_equal(*args, **kwargs)
 
     @property
     def schedule(self) -> Scheduler:
-        initial = update = False
+        initial = update = full = False
         if self._initial_read:
             logger.debug("DatabaseScheduler: initial read")
             initial = update = True
             self._initial_read = False
+            self._shard_changed()
+        elif self._shard_changed():
+            logger.info("DatabaseScheduler: Shard members changed.")
+            update = full = True
+        elif self._full_reload_due():
+            logger.debug("DatabaseScheduler: Delta reloads expired, reloading everything.")
+            update = full = True
         elif self.schedule_changed():
             # when you updated the `PeriodicTasks` model's `last_update` field
             logger.info("DatabaseScheduler: Schedule changed.")
             update = True
 
+        elif self._horizon_due():
+            self._patch_heap(*self.horizon_schedule())
+
         if update:
             self.sync()
-            self._schedule = self.all_as_schedule()
-            # the schedule changed, invalidate the heap in Scheduler.tick
-            if not initial:
-                self._heap: List[Any] = []
-                self._heap_invalidated = True
+            if self.delta_reload and not initial and not full:
+                # patch the schedule and the heap in place
+                self._patch_heap(*self.delta_schedule())
+            else:
+                self._schedule = self.all_as_schedule()
+                # the schedule changed, invalidate the heap in Scheduler.tick
+                if not initial:
+                    self._heap = []
+                    self._heap_invalidated = True
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(
                     "Current schedule:\n%s",
-                    "\n".join(repr(entry) for entry in self._schedule.values()),
+                    "\n".join(repr(entry) for entry in (self._schedule or {}).values()),
                 )
         # logger.debug(self._schedule)
         return self._schedule
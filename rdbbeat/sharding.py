@@ -0,0 +1,133 @@
+# Copyright (c) 2023 Hewlett Packard Enterprise Development LP
+# MIT License
+
+import bisect
+import datetime as dt
+import hashlib
+import logging
+import os
+import socket
+import uuid
+from typing import Iterable, List, Optional
+
+import sqlalchemy
+
+from rdbbeat.db.models import BeatLease
+
+# Seconds a member keeps its shard without renewing its lease.
+DEFAULT_LEASE_TTL = 30
+
+# Points per member on the hash ring, more points spread the tasks more evenly.
+DEFAULT_REPLICAS = 64
+
+logger = logging.getLogger(__name__)
+
+
+def stable_hash(value: str) -> int:
+    """Hash that is the same in every process, unlike the builtin `hash`."""
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring, a member joining or leaving only moves its own share of keys."""
+
+    def __init__(self, members: Iterable[str], replicas: int = DEFAULT_REPLICAS) -> None:
+        points = sorted(
+            (stable_hash(f"{member}#{replica}"), member)
+            for member in members
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._members = [member for _, member in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, stable_hash(key)) % len(self._hashes)
+        return self._members[index]
+
+
+class ShardMembership:
+    """
+    Membership of a beat process in a sharded schedule.
+
+    Every member renews its lease in `celery_beat_lease` with `heartbeat`, members whose
+    lease expired are removed. Periodic tasks are assigned to the live members by
+    consistent hashing on the task name.
+    """
+
+    def __init__(
+        self,
+        session_scope: sqlalchemy.orm.Session,
+        member_id: Optional[str] = None,
+        lease_ttl: int = DEFAULT_LEASE_TTL,
+        replicas: int = DEFAULT_REPLICAS,
+    ) -> None:
+        self.session_scope = session_scope
+        self.member_id = member_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_ttl = lease_ttl
+        self.replicas = replicas
+        self.members: List[str] = []
+        self.ring = HashRing([], replicas)
+
+    @property
+    def heartbeat_interval(self) -> float:
+        """Renew the lease well before it expires."""
+        return self.lease_ttl / 3
+
+    def heartbeat(self) -> bool:
+        """
+        Renew the lease of this member and expire dead members.
+
+        :returns: whether the live members changed since the last heartbeat
+        """
+        now = dt.datetime.now(dt.timezone.utc)
+        with self.session_scope() as session:
+            lease = (
+                session.query(BeatLease)
+                .filter_by(member_id=self.member_id)
+                .with_for_update()
+                .one_or_none()
+            )
+            if lease is None:
+                lease = BeatLease(member_id=self.member_id)
+                session.add(lease)
+            lease.expires_at = now + dt.timedelta(seconds=self.lease_ttl)
+
+            # leases being expired by another member are skipped
+            expired = (
+                session.query(BeatLease)
+                .filter(BeatLease.expires_at < now, BeatLease.member_id != self.member_id)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            for dead in expired:
+                logger.info("ShardMembership: Member %s left", dead.member_id)
+                session.delete(dead)
+            session.flush()
+
+            members = sorted(
+                member_id
+                for member_id, in session.query(BeatLease.member_id).filter(
+                    BeatLease.expires_at >= now
+                )
+            )
+            session.commit()
+
+        if members == self.members:
+            return False
+        logger.info("ShardMembership: Members changed to %s", members)
+        self.members = members
+        self.ring = HashRing(members, self.replicas)
+        return True
+
+    def owns(self, name: str) -> bool:
+        return self.ring.owner(name) == self.member_id
+
+    def leave(self) -> None:
+        """Give up the lease, so the other members take over right away."""
+        with self.session_scope() as session:
+            session.query(BeatLease).filter_by(member_id=self.member_id).delete()
+            session.commit()
+        self.members = []
+        self.ring = HashRing([], self.replicas)
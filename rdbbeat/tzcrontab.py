@@ -3,19 +3,33 @@
 # MIT License
 
 import datetime as dt
-from collections import namedtuple
+import threading
+from collections import OrderedDict, namedtuple
 from datetime import datetime
+from typing import Optional, Tuple
 
 import pytz
 from celery import Celery, schedules
+from celery.utils.time import maybe_make_aware
 from sqlalchemy_utils import TimezoneType
 
+from rdbbeat.cronmask import CronMask
+
 schedstate = namedtuple("schedstate", ("is_due", "next"))
 
+# Number of distinct compiled crontabs kept by the default cache.
+DEFAULT_CRONTAB_CACHE_SIZE = 1024
+
+# Seconds until a crontab that never fires is checked again.
+NEVER_CHECK_INTERVAL = 24 * 3600
+
 
 class TzAwareCrontab(schedules.crontab):
     """Timezone Aware Crontab."""
 
+    # fires this long after each crontab match, see `with_offset`
+    offset = dt.timedelta(0)
+
     def __init__(
         self,
         minute: str = "*",
@@ -28,6 +42,7 @@ class TzAwareCrontab(schedules.crontab):
     ) -> None:
         """Overwrite Crontab constructor to include a timezone argument."""
         self.tz = tz
+        self._mask: Optional[CronMask] = None
 
         nowfun = self.nowfunc
 
@@ -45,6 +60,43 @@ class TzAwareCrontab(schedules.crontab):
     def nowfunc(self) -> datetime:
         return self.tz.normalize(pytz.utc.localize(dt.datetime.utcnow()))
 
+    @property
+    def mask(self) -> CronMask:
+        """The cron fields compiled into bitmasks, built on first use."""
+        if self._mask is None:
+            self._mask = CronMask(
+                self.minute,
+                self.hour,
+                self.day_of_week,
+                self.day_of_month,
+                self.month_of_year,
+                tz=self.tz,
+            )
+        return self._mask
+
+    def with_offset(self, seconds: float) -> "TzAwareCrontab":
+        """Return a copy firing `seconds` after each match, sharing the compiled fields."""
+        self.mask  # compiled once for all the copies
+        schedule = self.__class__.__new__(self.__class__)
+        schedule.__dict__.update(self.__dict__)
+        schedule.offset = dt.timedelta(seconds=seconds)
+        return schedule
+
+    def next_fire(self, last_run_at: datetime) -> Optional[datetime]:
+        """Return the first fire time after `last_run_at`, which must be timezone aware."""
+        if not self.offset:
+            return self.mask.next_fire(last_run_at)
+        next_fire = self.mask.next_fire(last_run_at - self.offset)
+        return next_fire + self.offset if next_fire else None
+
+    def next_run_at(self, last_run_at: Optional[datetime] = None) -> Optional[datetime]:
+        """Return the next fire time in UTC after `last_run_at`, or after now if it never ran.
+
+        A naive `last_run_at` is taken as UTC.
+        """
+        next_fire = self.next_fire(maybe_make_aware(last_run_at) if last_run_at else self.now())
+        return next_fire.astimezone(pytz.utc) if next_fire else None
+
     def is_due(self, last_run_at: datetime) -> schedstate:
         """Calculate when the next run will take place.
 
@@ -54,13 +106,16 @@ class TzAwareCrontab(schedules.crontab):
         """
         # convert last_run_at to the schedule timezone
         last_run_at = last_run_at.astimezone(self.tz)
+        now = self.now()
 
-        rem_delta = self.remaining_estimate(last_run_at)
-        rem = max(rem_delta.total_seconds(), 0)
+        next_fire = self.next_fire(last_run_at)
+        if next_fire is None:
+            return schedstate(False, NEVER_CHECK_INTERVAL)
+        rem = max((next_fire - now).total_seconds(), 0)
         due = rem == 0
         if due:
-            rem_delta = self.remaining_estimate(self.now())
-            rem = max(rem_delta.total_seconds(), 0)
+            next_fire = self.next_fire(now)
+            rem = max((next_fire - now).total_seconds(), 0) if next_fire else NEVER_CHECK_INTERVAL
         return schedstate(due, rem)
 
     # Needed to support pickling
@@ -68,22 +123,22 @@ class TzAwareCrontab(schedules.crontab):
         return (
             f"<crontab: {self._orig_minute} {self._orig_hour} "
             f"{self._orig_day_of_week} {self._orig_day_of_month} "
-            f"{self._orig_month_of_year} (m/h/d/dM/MY), {self.tz}>"
+            f"{self._orig_month_of_year} (m/h/d/dM/MY), {self.tz}"
+            + (f", +{self.offset.total_seconds():g}s>" if self.offset else ">")
         )
 
     def __reduce__(self) -> schedules.crontab:
-        return (
-            self.__class__,
-            (
-                self._orig_minute,
-                self._orig_hour,
-                self._orig_day_of_week,
-                self._orig_day_of_month,
-                self._orig_month_of_year,
-                self.tz,
-            ),
-            None,
+        args = (
+            self._orig_minute,
+            self._orig_hour,
+            self._orig_day_of_week,
+            self._orig_day_of_month,
+            self._orig_month_of_year,
+            self.tz,
         )
+        if self.offset:
+            return (_with_offset, (self.__class__, args, self.offset.total_seconds()))
+        return (self.__class__, args, None)
 
     def __eq__(self, other: schedules.crontab) -> bool:
         if isinstance(other, schedules.crontab):
@@ -94,5 +149,77 @@ class TzAwareCrontab(schedules.crontab):
                 and other.hour == self.hour
                 and other.minute == self.minute
                 and other.tz == self.tz
+                and getattr(other, "offset", None) == self.offset
             )
         raise NotImplementedError
+
+
+def _with_offset(cls: type, args: Tuple, seconds: float) -> TzAwareCrontab:
+    return cls(*args).with_offset(seconds)
+
+
+class CrontabCache:
+    """Interning, LRU-bounded cache of compiled `TzAwareCrontab` objects.
+
+    Rows sharing the same crontab fields and timezone get the same schedule instance,
+    so the cron fields are parsed and the timezone looked up only once.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CRONTAB_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._schedules: "OrderedDict[Tuple[str, ...], TzAwareCrontab]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._schedules)
+
+    def get(
+        self,
+        minute: str = "*",
+        hour: str = "*",
+        day_of_week: str = "*",
+        day_of_month: str = "*",
+        month_of_year: str = "*",
+        timezone: str = "UTC",
+    ) -> TzAwareCrontab:
+        key = (minute, hour, day_of_week, day_of_month, month_of_year, timezone)
+        with self._lock:
+            schedule = self._schedules.get(key)
+            if schedule is not None:
+                self.hits += 1
+                self._schedules.move_to_end(key)
+                return schedule
+            self.misses += 1
+
+        schedule = TzAwareCrontab(
+            minute=minute,
+            hour=hour,
+            day_of_week=day_of_week,
+            day_of_month=day_of_month,
+            month_of_year=month_of_year,
+            tz=pytz.timezone(timezone),
+        )
+        if self.maxsize > 0:
+            with self._lock:
+                schedule = self._schedules.setdefault(key, schedule)
+                self._evict()
+        return schedule
+
+    def resize(self, maxsize: int) -> None:
+        """Change the maximum size, evicting the least recently used schedules."""
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._schedules.clear()
+            self.hits = self.misses = 0
+
+    def _evict(self) -> None:
+        while len(self._schedules) > max(self.maxsize, 0):
+            self._schedules.popitem(last=False)
+
+
+crontab_cache = CrontabCache()
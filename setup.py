@@ -34,4 +34,5 @@ setup(
         "python-dotenv",
         "pytz",
     ],
+    extras_require={"asyncio": ["sqlalchemy[asyncio]~=1.4"]},
 )
@@ -1,6 +1,13 @@
+from contextlib import contextmanager
+
 import pytest
+from celery import Celery
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
-from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+from rdbbeat.db.models import Base, CrontabSchedule, PeriodicTask
+from rdbbeat.schedulers import DatabaseScheduler
 
 
 @pytest.fixture
@@ -31,3 +38,59 @@ def scheduled_task_db_object(scheduled_task):
     )
 
     return task
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(
+        "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(engine, "connect")
+    def attach_scheduler_schema(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS scheduler")
+
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_scope(engine):
+    session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+
+    @contextmanager
+    def session_scope():
+        session = session_factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    return session_scope
+
+
+@pytest.fixture
+def app(session_scope):
+    app = Celery("tests", broker="memory://")
+    app.conf.update({"session_scope": session_scope, "result_expires": None})
+    return app
+
+
+@pytest.fixture
+def make_scheduler(app):
+    """Create schedulers on `app`, closed on teardown rather than at interpreter exit."""
+    schedulers = []
+
+    def make_scheduler(**kwargs):
+        scheduler = DatabaseScheduler(app=app, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make_scheduler
+    for scheduler in schedulers:
+        scheduler.close()
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.pool import StaticPool
+
+from rdbbeat.data_models import Schedule, ScheduledTask
+from rdbbeat.db.models import Base, CrontabSchedule, PeriodicTask, PeriodicTaskChanged
+
+pytest.importorskip("aiosqlite")
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+
+from rdbbeat import async_controller  # noqa: E402
+
+
+def run(test):
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def attach_scheduler_schema(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("ATTACH DATABASE ':memory:' AS scheduler")
+            cursor.close()
+
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        try:
+            await test(engine)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_schedule_update_and_delete_task():
+    async def test(engine):
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            task = await async_controller.schedule_task(
+                session,
+                ScheduledTask(name="task_1", task="echo", schedule=Schedule(minute="5")),
+                queue="reports",
+            )
+            await session.commit()
+            first_change = await session.run_sync(PeriodicTaskChanged.last_change)
+            assert first_change is not None
+
+            task = await async_controller.update_task_enabled_status(session, False, task.id)
+            await session.commit()
+            assert task.enabled is False
+            assert await session.run_sync(PeriodicTaskChanged.last_change) > first_change
+
+            task = await async_controller.update_task(
+                session,
+                ScheduledTask(name="task_2", task="echo", schedule=Schedule(minute="10")),
+                task.id,
+            )
+            await session.commit()
+            assert task.name == "task_2"
+
+            await async_controller.delete_task(session, task.id)
+            await session.commit()
+            assert await session.scalar(select(func.count(PeriodicTask.id))) == 0
+            assert await session.scalar(select(func.count(CrontabSchedule.id))) == 1
+
+    run(test)
+
+
+def test_bulk_operations():
+    async def test(engine):
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            count = await async_controller.schedule_tasks(
+                session,
+                [
+                    ScheduledTask(name=f"task_{i}", task="echo", schedule=Schedule(minute=str(i)))
+                    for i in range(4)
+                ],
+            )
+            assert count == 4
+            assert await async_controller.set_tasks_enabled(session, False, ids=[1, 2]) == 2
+            assert await async_controller.delete_tasks(session, name_prefix="task_") == 4
+            await session.commit()
+            assert await session.scalar(select(func.count(CrontabSchedule.id))) == 0
+            assert await session.run_sync(PeriodicTaskChanged.last_change) is not None
+
+    run(test)
@@ -0,0 +1,193 @@
+import gc
+import socket
+import threading
+
+import pytest
+from sqlalchemy.pool import QueuePool
+
+from rdbbeat.changefeed import (
+    ChangeFeed,
+    LocalChangeFeed,
+    PostgresChangeFeed,
+    register_change_feed,
+    unregister_change_feed,
+)
+from rdbbeat.db.models import CrontabSchedule, PeriodicTask, PeriodicTaskChanged
+
+
+@pytest.fixture
+def change_feed():
+    feed = LocalChangeFeed()
+    register_change_feed(feed)
+    yield feed
+    unregister_change_feed(feed)
+
+
+def add_task(session_scope, name):
+    with session_scope() as session:
+        session.add(PeriodicTask(name=name, task="echo", crontab=CrontabSchedule(minute="0")))
+
+
+def test_local_change_feed_notifies_on_commit(session_scope, change_feed):
+    with session_scope() as session:
+        session.add(PeriodicTask(name="task_1", task="echo"))
+        session.flush()
+        assert change_feed.poll() is False
+
+    assert change_feed.wait(0) is True
+    assert change_feed.poll() is True
+    assert change_feed.poll() is False
+
+
+def test_incomplete_change_feed_cannot_be_created():
+    class NotifyOnly(ChangeFeed):
+        def notify(self, connection):
+            pass
+
+    with pytest.raises(TypeError):
+        NotifyOnly()  # type: ignore[abstract]
+
+
+def test_scheduler_reloads_on_notification(session_scope, change_feed, make_scheduler):
+    scheduler = make_scheduler(change_feed=change_feed)
+    scheduler.schedule
+    scheduler._last_poll = None
+    assert scheduler.schedule_changed() is False
+    assert scheduler.max_interval == 300
+
+    add_task(session_scope, "task_1")
+
+    assert "task_1" in scheduler.schedule
+
+
+def test_scheduler_skips_database_without_notification(session_scope, change_feed, make_scheduler):
+    scheduler = make_scheduler(change_feed=change_feed)
+    scheduler.schedule
+    scheduler.schedule_changed()
+
+    with session_scope() as session:
+        PeriodicTaskChanged.update_changed(None, session.connection(), None)
+    change_feed.poll()
+
+    assert scheduler.schedule_changed() is False
+
+
+def test_tick_wakes_up_on_change(session_scope, change_feed, make_scheduler):
+    scheduler = make_scheduler(change_feed=change_feed)
+    timer = threading.Timer(0.1, add_task, (session_scope, "task_1"))
+    timer.start()
+
+    assert scheduler.tick() == 0
+    timer.join()
+    assert "task_1" in scheduler.schedule
+
+
+def test_postgres_change_feed_notify():
+    class Connection:
+        def __init__(self):
+            self.statements = []
+
+        def execute(self, statement):
+            self.statements.append(str(statement))
+
+    connection = Connection()
+    PostgresChangeFeed(channel="beat_changes").notify(connection)
+
+    assert connection.statements == ["NOTIFY beat_changes"]
+    with pytest.raises(ValueError):
+        PostgresChangeFeed(channel="beat; DROP TABLE")
+
+
+class ListeningConnection:
+    """DBAPI connection receiving a notification for every byte sent to `sender`."""
+
+    def __init__(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.receiver.setblocking(False)
+        self.autocommit = False
+        self.statements = []
+        self.notifies = []
+        self.closed = False
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                pass
+
+            def execute(self, statement):
+                connection.statements.append(statement)
+
+        return Cursor()
+
+    def fileno(self):
+        return self.receiver.fileno()
+
+    def poll(self):
+        try:
+            self.notifies.extend(self.receiver.recv(1024))
+        except BlockingIOError:
+            pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+        self.sender.close()
+        self.receiver.close()
+
+
+class Engine:
+    def __init__(self):
+        self.connections = []
+        self.pool = QueuePool(self.connect, pool_size=1)
+
+    def connect(self):
+        self.connections.append(ListeningConnection())
+        return self.connections[-1]
+
+    def raw_connection(self):
+        return self.pool.connect()
+
+
+def test_postgres_change_feed_wait_and_poll():
+    engine = Engine()
+    feed = PostgresChangeFeed(engine, channel="beat_changes")
+
+    assert feed.wait(0) is False
+    connection = feed.connection
+    assert connection.autocommit is True
+    assert connection.statements == ["LISTEN beat_changes"]
+
+    threading.Timer(0.05, connection.sender.send, (b"x",)).start()
+    assert feed.wait(5) is True
+    # `wait` does not consume the notification
+    assert feed.wait(0) is True
+    assert feed.poll() is True
+    assert feed.poll() is False
+
+    connection.sender.send(b"xy")
+    assert feed.poll() is True
+    assert feed.poll() is False
+
+    feed.close()
+    assert connection.closed
+
+
+def test_postgres_change_feed_keeps_its_connection_out_of_the_pool():
+    engine = Engine()
+    feed = PostgresChangeFeed(engine)
+    listening = feed.connection
+    gc.collect()
+
+    other = engine.raw_connection()
+    assert other.connection is not listening
+    assert other.connection.autocommit is False
+    other.close()
+    feed.close()
+    assert listening.closed
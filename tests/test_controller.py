@@ -1,20 +1,32 @@
+import datetime as dt
 import json
-from typing import Dict
+from typing import Dict, List
 
 import pytest
 from mock import patch
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 from rdbbeat.controller import (
+    delete_orphan_crontabs,
     delete_task,
+    delete_tasks,
     get_crontab_schedule,
     is_crontab_used,
     schedule_task,
+    schedule_tasks,
+    set_tasks_enabled,
     update_task,
     update_task_enabled_status,
 )
 from rdbbeat.data_models import Schedule, ScheduledTask
-from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+from rdbbeat.db.models import (
+    CrontabSchedule,
+    PeriodicTask,
+    PeriodicTaskChanged,
+    crontab_fingerprint,
+)
 from rdbbeat.exceptions import PeriodicTaskNotFound
 
 
@@ -149,3 +161,213 @@ def test_is_crontab_used(scheduled_task_db_object):
 
         result = is_crontab_used(mock_session, scheduled_task_db_object.schedule)
         assert result is False
+
+
+def test_schedule_tasks(engine, session_scope):
+    with session_scope() as session:
+        session.add(CrontabSchedule(**Schedule(minute="0").dict()))
+        session.add(PeriodicTaskChanged(id=1, last_update=dt.datetime(2000, 1, 1)))
+    scheduled_tasks = [
+        ScheduledTask(name=f"task_{i}", task="echo", schedule=Schedule(minute=str(i % 5)))
+        for i in range(50)
+    ]
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with session_scope() as session:
+        assert schedule_tasks(session, scheduled_tasks, queue="bulk", report="daily") == 50
+
+    marker_updates = [
+        s for s in statements if s.startswith("UPDATE scheduler.celery_periodic_task_changed")
+    ]
+    assert len(marker_updates) == 1
+    with session_scope() as session:
+        assert session.query(CrontabSchedule).count() == 5
+        tasks = session.query(PeriodicTask).order_by(PeriodicTask.id).all()
+        assert len(tasks) == 50
+        assert tasks[7].crontab.minute == "2"
+        assert tasks[7].queue == "bulk"
+        assert tasks[7].kwargs == json.dumps({"report": "daily"})
+        assert tasks[7].enabled is True
+        last_change = PeriodicTaskChanged.last_change(session)
+        assert last_change is not None and last_change > dt.datetime(2000, 1, 1)
+
+
+def test_schedule_tasks_with_crontab_created_concurrently(engine, session_scope):
+    created: List[str] = []
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def create_crontab(conn, cursor, statement, *args):
+        # another writer commits the same crontab right after the lookup
+        if "FROM scheduler.celery_crontab_schedule" in statement and not created:
+            created.append(crontab_fingerprint("1"))
+            cursor.connection.execute(
+                "INSERT INTO scheduler.celery_crontab_schedule (minute, hour, day_of_week, "
+                "day_of_month, month_of_year, timezone, fingerprint) "
+                "VALUES ('1', '*', '*', '*', '*', 'UTC', ?)",
+                created,
+            )
+
+    scheduled_tasks = [
+        ScheduledTask(name=f"task_{i}", task="echo", schedule=Schedule(minute=str(i % 3)))
+        for i in range(6)
+    ]
+    with session_scope() as session:
+        assert schedule_tasks(session, scheduled_tasks) == 6
+
+    with session_scope() as session:
+        assert session.query(CrontabSchedule).count() == 3
+        tasks = session.query(PeriodicTask).order_by(PeriodicTask.id).all()
+        assert [task.crontab.minute for task in tasks] == ["0", "1", "2"] * 2
+
+
+def test_schedule_task_reuses_crontab_within_transaction(engine, session_scope):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with session_scope() as session:
+        for i in range(10):
+            schedule_task(
+                session, ScheduledTask(name=f"task_{i}", task="echo", schedule=Schedule())
+            )
+
+    crontab_selects = [s for s in statements if "FROM scheduler.celery_crontab_schedule" in s]
+    assert len(crontab_selects) == 1
+    with session_scope() as session:
+        assert session.query(CrontabSchedule).count() == 1
+        assert session.query(PeriodicTask).count() == 10
+
+
+def test_schedule_task_after_deleting_memoized_crontab(session_scope):
+    with session_scope() as session:
+        task = schedule_task(
+            session, ScheduledTask(name="task_1", task="echo", schedule=Schedule())
+        )
+        session.flush()
+        delete_task(session, task.id)
+        session.flush()
+
+        task = schedule_task(
+            session, ScheduledTask(name="task_2", task="echo", schedule=Schedule())
+        )
+        session.flush()
+        assert task.crontab.id is not None
+
+    with session_scope() as session:
+        assert session.query(CrontabSchedule).count() == 1
+        assert session.query(PeriodicTask).one().name == "task_2"
+
+
+def test_crontab_fingerprint_is_unique(session_scope):
+    with session_scope() as session:
+        session.add(CrontabSchedule(minute="0", hour="1"))
+
+    with pytest.raises(IntegrityError):
+        with session_scope() as session:
+            session.add(CrontabSchedule(minute=" 0", hour="1", timezone="UTC"))
+
+    with session_scope() as session:
+        assert get_crontab_schedule(session, Schedule(minute="0", hour="1")).id == 1
+
+
+def test_delete_tasks(engine, session_scope):
+    with session_scope() as session:
+        schedule_tasks(
+            session,
+            [
+                ScheduledTask(name=f"tenant_{i}", task="echo", schedule=Schedule(minute=str(i)))
+                for i in range(10)
+            ],
+        )
+        schedule_task(session, ScheduledTask(name="other", task="echo", schedule=Schedule()), "q")
+        schedule_task(session, ScheduledTask(name="tenant%x", task="echo", schedule=Schedule()))
+        # e.g. created by a transaction about to schedule a task
+        session.add(CrontabSchedule(minute="42"))
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with session_scope() as session:
+        assert delete_tasks(session, name_prefix="tenant_") == 10
+
+    deletes = [s for s in statements if s.startswith("DELETE")]
+    assert len(deletes) == 2
+    with session_scope() as session:
+        names = {name for name, in session.query(PeriodicTask.name)}
+        assert names == {"other", "tenant%x"}
+        minutes = {minute for minute, in session.query(CrontabSchedule.minute)}
+        assert minutes == {"*", "42"}
+        assert delete_tasks(session, ids=[1, 2, 3], queue="q") == 0
+        assert delete_tasks(session, queue="q", delete_orphans=False) == 1
+
+    with session_scope() as session:
+        assert session.query(CrontabSchedule).count() == 2
+        assert delete_orphan_crontabs(session) == 1
+
+
+def test_delete_tasks_requires_criteria():
+    with patch("sqlalchemy.orm.Session") as mock_session:
+        with pytest.raises(ValueError):
+            delete_tasks(mock_session)
+        mock_session.query.assert_not_called()
+
+
+def test_delete_orphan_crontabs(session_scope):
+    with session_scope() as session:
+        schedule_task(session, ScheduledTask(name="task_1", task="echo", schedule=Schedule()))
+        session.add(CrontabSchedule(minute="1"))
+        session.add(CrontabSchedule(minute="2"))
+
+    with session_scope() as session:
+        assert get_crontab_schedule(session, Schedule(minute="1")).id is not None
+        assert delete_orphan_crontabs(session) == 2
+        assert get_crontab_schedule(session, Schedule(minute="1")).id is None
+        assert session.query(CrontabSchedule).count() == 1
+
+
+def test_set_tasks_enabled(engine, session_scope, make_scheduler):
+    with session_scope() as session:
+        for i in range(6):
+            schedule_task(
+                session,
+                ScheduledTask(name=f"task_{i}", task="echo", schedule=Schedule()),
+                queue=f"queue_{i % 2}",
+            )
+    scheduler = make_scheduler()
+    assert len(scheduler.schedule) == 6
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with session_scope() as session:
+        assert set_tasks_enabled(session, False, queue="queue_1") == 3
+
+    updates = [s for s in statements if s.startswith("UPDATE")]
+    assert len(updates) == 2
+    assert set(scheduler.schedule) == {"task_0", "task_2", "task_4"}
+
+    with session_scope() as session:
+        assert set_tasks_enabled(session, False, queue="queue_1") == 0
+        assert set_tasks_enabled(session, True, name_prefix="task_", ids=[2, 3]) == 1
+    assert set(scheduler.schedule) == {"task_0", "task_1", "task_2", "task_4"}
+
+
+def test_controller_maintains_next_run_at(session_scope):
+    with session_scope() as session:
+        task = schedule_task(
+            session, ScheduledTask(name="task_1", task="echo", schedule=Schedule(minute="5"))
+        )
+        schedule_tasks(
+            session, [ScheduledTask(name="task_2", task="echo", schedule=Schedule(minute="5"))]
+        )
+    with session_scope() as session:
+        next_run_at = {
+            name: at for name, at in session.query(PeriodicTask.name, PeriodicTask.next_run_at)
+        }
+        assert next_run_at["task_1"] == next_run_at["task_2"]
+        assert next_run_at["task_1"].minute == 5
+
+        task = update_task(
+            session,
+            ScheduledTask(name="task_1", task="echo", schedule=Schedule(minute="7")),
+            task.id,
+        )
+        assert task.next_run_at.minute == 7
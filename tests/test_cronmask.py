@@ -0,0 +1,108 @@
+import datetime as dt
+import random
+
+import pytz
+from celery import schedules
+
+from rdbbeat.cronmask import CronMask, next_bit, next_fire_times, to_mask
+
+eastern = pytz.timezone("US/Eastern")
+
+
+def mask_for(
+    minute="*", hour="*", day_of_week="*", day_of_month="*", month_of_year="*", tz=pytz.utc
+):
+    crontab = schedules.crontab(minute, hour, day_of_week, day_of_month, month_of_year)
+    return CronMask(
+        crontab.minute,
+        crontab.hour,
+        crontab.day_of_week,
+        crontab.day_of_month,
+        crontab.month_of_year,
+        tz=tz,
+    )
+
+
+def test_next_bit():
+    mask = to_mask({3, 10, 59})
+    assert next_bit(mask, 0) == 3
+    assert next_bit(mask, 4) == 10
+    assert next_bit(mask, 10) == 10
+    assert next_bit(mask, 60) is None
+
+
+def test_next_fire_matches_celery_crontab():
+    rng = random.Random(42)
+    candidates = (
+        ("*", "*/15", "7", "0,30", "1-5"),
+        ("*", "*/3", "1,13", "0"),
+        ("*", "mon", "1-5", "sun,sat"),
+        ("*", "1,15", "10-20", "29"),
+        ("*", "2,8", "*/3"),
+    )
+    for _ in range(300):
+        minute, hour, day_of_week, day_of_month, month_of_year = (
+            rng.choice(values) for values in candidates
+        )
+        last_run_at = pytz.utc.localize(
+            dt.datetime(2023, 1, 1) + dt.timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))
+        )
+        crontab = schedules.crontab(
+            minute, hour, day_of_week, day_of_month, month_of_year, nowfun=lambda: last_run_at
+        )
+        expected = last_run_at.replace(second=0, microsecond=0) + crontab.remaining_estimate(
+            last_run_at
+        )
+        mask = mask_for(minute, hour, day_of_week, day_of_month, month_of_year)
+        assert mask.next_fire(last_run_at) == expected, crontab
+
+
+def test_next_fire_never_matches():
+    mask = mask_for(minute="0", hour="0", day_of_month="31", month_of_year="2")
+
+    assert mask.next_fire(pytz.utc.localize(dt.datetime(2023, 1, 1))) is None
+
+
+def test_next_fire_spring_forward():
+    mask = mask_for(minute="30", hour="2", tz=eastern)
+    last_run_at = eastern.localize(dt.datetime(2024, 3, 9, 2, 30))
+
+    next_fire = mask.next_fire(last_run_at)
+
+    # 02:30 does not exist on 2024-03-10, it fires after the gap
+    assert next_fire == eastern.localize(dt.datetime(2024, 3, 10, 3, 30))
+    assert mask.next_fire(next_fire) == eastern.localize(dt.datetime(2024, 3, 11, 2, 30))
+
+
+def test_next_fire_fall_back_fires_once():
+    mask = mask_for(minute="30", hour="1", tz=eastern)
+    last_run_at = eastern.localize(dt.datetime(2024, 11, 2, 1, 30))
+
+    next_fire = mask.next_fire(last_run_at)
+
+    assert next_fire == eastern.localize(dt.datetime(2024, 11, 3, 1, 30), is_dst=True)
+    assert mask.next_fire(next_fire) == eastern.localize(dt.datetime(2024, 11, 4, 1, 30))
+
+
+def test_next_fire_during_repeated_hour():
+    mask = mask_for(minute="*/15", tz=eastern)
+    last_run_at = eastern.localize(dt.datetime(2024, 11, 3, 1, 5), is_dst=False)
+
+    next_fire = mask.next_fire(last_run_at)
+
+    assert next_fire == eastern.localize(dt.datetime(2024, 11, 3, 1, 15), is_dst=False)
+    assert next_fire - last_run_at == dt.timedelta(minutes=10)
+
+
+def test_next_fire_times():
+    hourly = mask_for(minute="0")
+    daily = mask_for(minute="0", hour="4")
+    last_run_at = pytz.utc.localize(dt.datetime(2023, 5, 1, 12, 30, 15))
+
+    assert next_fire_times(
+        [(hourly, last_run_at), (daily, last_run_at), (hourly, last_run_at)]
+    ) == [
+        pytz.utc.localize(dt.datetime(2023, 5, 1, 13)),
+        pytz.utc.localize(dt.datetime(2023, 5, 2, 4)),
+        pytz.utc.localize(dt.datetime(2023, 5, 1, 13)),
+    ]
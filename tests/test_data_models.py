@@ -1,7 +1,7 @@
 import pytest
 from pydantic import ValidationError
 
-from rdbbeat.data_models import Schedule
+from rdbbeat.data_models import Schedule, ScheduledTask
 
 
 def test_schedule_pass():
@@ -133,3 +133,14 @@ def test_schedule_invalid_month():
     }
     with pytest.raises(ValidationError, match="Month of year value must range between 0 and 12"):
         Schedule.parse_obj(schedule)
+
+
+def test_scheduled_task_invalid_catch_up():
+    scheduled_task = {
+        "name": "task_1",
+        "task": "echo",
+        "schedule": {"minute": "23"},
+        "catch_up": "all",
+    }
+    with pytest.raises(ValidationError, match="Catch-up: 'all' is not one of"):
+        ScheduledTask.parse_obj(scheduled_task)
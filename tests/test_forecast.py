@@ -0,0 +1,66 @@
+import datetime as dt
+
+import pytz
+from sqlalchemy import event
+
+from rdbbeat.controller import schedule_tasks
+from rdbbeat.data_models import Schedule, ScheduledTask
+from rdbbeat.forecast import fire_density
+
+
+def test_fire_density(engine, session_scope):
+    hourly = Schedule(minute="0")
+    half_hourly = Schedule(minute="30", hour="*")
+    with session_scope() as session:
+        schedule_tasks(
+            session,
+            [ScheduledTask(name=f"a_{i}", task="echo", schedule=hourly) for i in range(30)],
+            queue="a",
+        )
+        schedule_tasks(
+            session,
+            [ScheduledTask(name=f"b_{i}", task="echo", schedule=hourly) for i in range(20)],
+            queue="b",
+        )
+        schedule_tasks(
+            session,
+            [ScheduledTask(name="c_0", task="echo", schedule=half_hourly)],
+            queue="b",
+        )
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    start = dt.datetime(2026, 1, 1, 10, 15, tzinfo=pytz.utc)
+    with session_scope() as session:
+        density = fire_density(session, start, start + dt.timedelta(hours=2))
+
+    assert len(statements) == 1
+    eleven, noon = start.replace(hour=11, minute=0), start.replace(hour=12, minute=0)
+    assert density.busiest(2) == [(eleven, 50), (noon, 50)]
+    assert density.peak == 50
+    assert density.total[start.replace(minute=30)] == 1
+    assert sum(density.total.values()) == 102
+    assert density.by_queue["a"][eleven] == 30
+    assert density.by_queue["b"][eleven] == 20
+    assert len(density.by_crontab) == 2
+    assert sorted(sum(c.values()) for c in density.by_crontab.values()) == [2, 100]
+
+
+def test_fire_density_respects_crontab_timezone(session_scope):
+    with session_scope() as session:
+        schedule_tasks(
+            session,
+            [
+                ScheduledTask(
+                    name="task_1",
+                    task="echo",
+                    schedule=Schedule(minute="0", hour="9", timezone="America/New_York"),
+                )
+            ],
+        )
+        density = fire_density(session, dt.datetime(2026, 7, 1), dt.datetime(2026, 7, 3))
+
+    assert list(density.total) == [
+        dt.datetime(2026, 7, 1, 13, tzinfo=pytz.utc),
+        dt.datetime(2026, 7, 2, 13, tzinfo=pytz.utc),
+    ]
@@ -0,0 +1,101 @@
+import datetime as dt
+
+import pytz
+
+from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+from rdbbeat.journal import RunStateJournal
+
+last_run_at = pytz.utc.localize(dt.datetime(2023, 5, 1, 12, 30))
+
+
+def test_journal_replay_coalesces_records(tmp_path):
+    journal = RunStateJournal(str(tmp_path / "beat.journal"), fsync=False)
+    next_run_at = last_run_at + dt.timedelta(hours=1)
+    journal.append([(1, last_run_at, 1, next_run_at), (2, last_run_at, 7, None)])
+    journal.append([(1, last_run_at + dt.timedelta(minutes=1), 2, next_run_at)])
+
+    states = journal.replay()
+
+    assert states == {
+        1: {
+            "id": 1,
+            "last_run_at": last_run_at + dt.timedelta(minutes=1),
+            "total_run_count": 2,
+            "next_run_at": next_run_at,
+        },
+        2: {"id": 2, "last_run_at": last_run_at, "total_run_count": 7, "next_run_at": None},
+    }
+    journal.discard([1])
+    assert journal.replay() == {2: states[2]}
+    journal.truncate()
+    assert journal.replay() == {}
+
+
+def test_journal_skips_torn_records(tmp_path):
+    path = tmp_path / "beat.journal"
+    journal = RunStateJournal(str(path), fsync=False)
+    journal.append([(1, last_run_at, 1, None)])
+    with open(path, "a") as f:
+        f.write('{"id": 1, "last_run_at": "2023-05')
+
+    assert journal.replay() == {
+        1: {"id": 1, "last_run_at": last_run_at, "total_run_count": 1, "next_run_at": None}
+    }
+
+
+def test_scheduler_replays_journal_on_startup(session_scope, tmp_path, make_scheduler):
+    path = str(tmp_path / "beat.journal")
+    with session_scope() as session:
+        task = PeriodicTask(name="task_1", task="echo", crontab=CrontabSchedule(minute="0"))
+        session.add(task)
+    journal = RunStateJournal(path)
+    next_run_at = last_run_at + dt.timedelta(minutes=30)
+    journal.append([(task.id, last_run_at, 5, next_run_at)])
+    journal.close()
+
+    scheduler = make_scheduler(journal_path=path)
+
+    assert scheduler.schedule["task_1"].total_run_count == 5
+    with session_scope() as session:
+        assert session.query(PeriodicTask.next_run_at).scalar() == next_run_at.replace(tzinfo=None)
+    assert scheduler.journal is not None
+    assert scheduler.journal.replay() == {}
+
+
+def test_scheduler_journals_until_sync(session_scope, tmp_path, make_scheduler):
+    with session_scope() as session:
+        session.add(PeriodicTask(name="task_1", task="echo", crontab=CrontabSchedule(minute="0")))
+    scheduler = make_scheduler(
+        journal_path=str(tmp_path / "beat.journal"), journal_flush_interval=60
+    )
+
+    entry = scheduler.reserve(scheduler.schedule["task_1"])
+
+    assert scheduler.sync_every == 60
+    assert scheduler.journal is not None
+    assert scheduler.journal.replay()[entry.model.id]["total_run_count"] == 1
+    scheduler.sync()
+    assert scheduler.journal.replay() == {}
+    with session_scope() as session:
+        assert session.query(PeriodicTask).one().total_run_count == 1
+    scheduler.close()
+
+
+def test_sync_keeps_journaled_run_states_not_saved(session_scope, tmp_path, make_scheduler):
+    with session_scope() as session:
+        crontab = CrontabSchedule(minute="0")
+        for name in ("task_1", "task_2"):
+            session.add(PeriodicTask(name=name, task="echo", crontab=crontab))
+    scheduler = make_scheduler(journal_path=str(tmp_path / "beat.journal"))
+    first = scheduler.reserve(scheduler.schedule["task_1"])
+    second = scheduler.reserve(scheduler.schedule["task_2"])
+    # removed from the schedule before its run state was saved
+    del scheduler.schedule["task_2"]
+
+    scheduler.sync()
+
+    assert scheduler.journal is not None
+    states = scheduler.journal.replay()
+    assert list(states) == [second.model.id]
+    assert states[second.model.id]["next_run_at"] is not None
+    assert first.model.id not in states
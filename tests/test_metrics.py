@@ -0,0 +1,68 @@
+import urllib.request
+
+from rdbbeat.metrics import MetricsSink, PrometheusMetrics
+
+
+def test_render_histogram_counter_and_gauge():
+    metrics = PrometheusMetrics(buckets=(0.1, 1))
+    metrics.observe("rdbbeat_tick_duration_seconds", 0.05)
+    metrics.observe("rdbbeat_tick_duration_seconds", 0.5)
+    metrics.observe("rdbbeat_tick_duration_seconds", 2)
+    metrics.increment("rdbbeat_dispatches_total", labels={"queue": 'say "hi"'})
+    metrics.increment("rdbbeat_dispatches_total", labels={"queue": 'say "hi"'})
+    metrics.set("rdbbeat_reload_entries", 3)
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE rdbbeat_tick_duration_seconds histogram" in lines
+    assert 'rdbbeat_tick_duration_seconds_bucket{le="0.1"} 1' in lines
+    assert 'rdbbeat_tick_duration_seconds_bucket{le="1.0"} 2' in lines
+    assert 'rdbbeat_tick_duration_seconds_bucket{le="+Inf"} 3' in lines
+    assert "rdbbeat_tick_duration_seconds_sum 2.55" in lines
+    assert "rdbbeat_tick_duration_seconds_count 3" in lines
+    assert "# TYPE rdbbeat_dispatches_total counter" in lines
+    assert 'rdbbeat_dispatches_total{queue="say \\"hi\\""} 2' in lines
+    assert "# TYPE rdbbeat_reload_entries gauge" in lines
+    assert "rdbbeat_reload_entries 3" in lines
+
+
+def test_timer_observes_duration():
+    observed = []
+
+    class Sink(MetricsSink):
+        def observe(self, name, value, labels=None):
+            observed.append((name, value))
+
+    with Sink().timer("rdbbeat_sync_duration_seconds"):
+        pass
+    assert [name for name, _ in observed] == ["rdbbeat_sync_duration_seconds"]
+    assert observed[0][1] >= 0
+
+
+def test_write_to_file(tmp_path):
+    path = tmp_path / "rdbbeat.prom"
+    metrics = PrometheusMetrics(path=str(path), write_interval=3600)
+    metrics.set("rdbbeat_reload_entries", 1)
+    metrics.flush()
+    assert "rdbbeat_reload_entries 1" in path.read_text()
+
+    # not rewritten before the interval, except on close
+    metrics.set("rdbbeat_reload_entries", 2)
+    metrics.flush()
+    assert "rdbbeat_reload_entries 1" in path.read_text()
+    metrics.close()
+    assert "rdbbeat_reload_entries 2" in path.read_text()
+    assert [file.name for file in tmp_path.iterdir()] == ["rdbbeat.prom"]
+
+
+def test_serve_on_localhost():
+    metrics = PrometheusMetrics()
+    metrics.increment("rdbbeat_dispatches_total")
+    server = metrics.serve(0)
+    try:
+        host, port = server.server_address[:2]
+        assert host == "127.0.0.1"
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "rdbbeat_dispatches_total 1" in response.read().decode()
+    finally:
+        metrics.close()
@@ -0,0 +1,105 @@
+from sqlalchemy import event
+
+from rdbbeat.db.models import (
+    CHANGE_LOG,
+    CrontabSchedule,
+    PeriodicTask,
+    PeriodicTaskChanged,
+    PeriodicTaskChangeLog,
+)
+
+
+def marker_statements(engine):
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, *args):
+        if "celery_periodic_task_changed" in statement:
+            statements.append(statement.split()[0])
+
+    return statements
+
+
+def test_marker_bumped_once_per_transaction(engine, session_scope):
+    statements = marker_statements(engine)
+
+    with session_scope() as session:
+        crontab = CrontabSchedule(minute="0")
+        for i in range(20):
+            session.add(PeriodicTask(name=f"task_{i}", task="echo", crontab=crontab))
+            session.flush()
+
+    assert statements == ["UPDATE", "INSERT"]
+    with session_scope() as session:
+        first_change = PeriodicTaskChanged.last_change(session)
+        assert first_change is not None
+
+    statements.clear()
+    with session_scope() as session:
+        for task in session.query(PeriodicTask):
+            task.enabled = False
+
+    assert statements == ["UPDATE"]
+    with session_scope() as session:
+        last_change = PeriodicTaskChanged.last_change(session)
+        assert last_change is not None and last_change >= first_change
+
+
+def test_marker_not_bumped_on_rollback(engine, session_scope):
+    statements = marker_statements(engine)
+
+    with session_scope() as session:
+        session.add(PeriodicTask(name="task_1", task="echo"))
+        session.flush()
+        session.rollback()
+
+    assert statements == []
+    with session_scope() as session:
+        assert PeriodicTaskChanged.last_change(session) is None
+
+
+def test_marker_bumped_after_savepoint_rollback(engine, session_scope):
+    statements = marker_statements(engine)
+
+    with session_scope() as session:
+        session.add(PeriodicTask(name="task_1", task="echo"))
+        session.flush()
+        savepoint = session.begin_nested()
+        session.add(PeriodicTask(name="task_2", task="echo"))
+        session.flush()
+        savepoint.rollback()
+
+    assert statements == ["UPDATE", "INSERT"]
+    with session_scope() as session:
+        assert session.query(PeriodicTask.name).all() == [("task_1",)]
+
+
+def test_flag_set_after_before_commit_is_cleared(engine, session_scope):
+    statements = marker_statements(engine)
+
+    with session_scope() as session:
+        # flushed by the commit, once the marker is bumped or not
+        event.listen(
+            session,
+            "before_commit",
+            lambda session: session.add(PeriodicTask(name="task_1", task="echo")),
+            once=True,
+        )
+        session.commit()
+        statements.clear()
+
+    assert statements == []
+
+
+def test_change_log_appends_entries(monkeypatch, session_scope):
+    monkeypatch.setattr(PeriodicTaskChanged, "tracking", CHANGE_LOG)
+
+    for i in range(3):
+        with session_scope() as session:
+            session.add(PeriodicTask(name=f"task_{i}", task="echo"))
+
+    with session_scope() as session:
+        assert PeriodicTaskChanged.last_change(session) is None
+        assert PeriodicTaskChangeLog.last_sequence(session) == 3
+        assert PeriodicTaskChangeLog.prune(session, before=3) == 2
+        assert session.query(PeriodicTaskChangeLog.id).all() == [(3,)]
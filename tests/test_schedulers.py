@@ -0,0 +1,501 @@
+import datetime as dt
+
+import pytest
+import pytz
+import sqlalchemy
+from kombu.serialization import dumps
+from mock import patch
+
+from rdbbeat import schedulers
+from rdbbeat.controller import delete_tasks, get_crontab_schedule
+from rdbbeat.data_models import Schedule
+from rdbbeat.db.models import (
+    CHANGE_LOG,
+    PeriodicTask,
+    PeriodicTaskChanged,
+    PeriodicTaskChangeLog,
+)
+from rdbbeat.metrics import PrometheusMetrics
+from rdbbeat.schedulers import ModelEntry
+
+
+def add_task(session_scope, name, minute="*", **kwargs):
+    with session_scope() as session:
+        crontab = get_crontab_schedule(session, Schedule(minute=minute))
+        task = PeriodicTask(name=name, task="echo", crontab=crontab, **kwargs)
+        session.add(task)
+    return task
+
+
+def test_delta_schedule_patches_in_place(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    add_task(session_scope, "task_2")
+    scheduler = make_scheduler(delta_reload=True)
+    schedule = scheduler.schedule
+
+    add_task(session_scope, "task_3")
+    with session_scope() as session:
+        task = session.query(PeriodicTask).filter_by(name="task_2").one()
+        task.enabled = False
+
+    changed, removed = scheduler.delta_schedule()
+
+    assert "task_3" in changed
+    assert removed == {"task_2"}
+    assert set(schedule) == {"task_1", "task_3"}
+    assert scheduler._schedule is schedule
+
+
+def test_delta_schedule_handles_delete_and_rename(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    add_task(session_scope, "task_2")
+    scheduler = make_scheduler(delta_reload=True)
+    scheduler.schedule
+
+    with session_scope() as session:
+        session.query(PeriodicTask).filter_by(name="task_1").one().name = "task_1_renamed"
+        session.delete(session.query(PeriodicTask).filter_by(name="task_2").one())
+
+    changed, removed = scheduler.delta_schedule()
+
+    assert removed == {"task_1", "task_2"}
+    assert set(scheduler.schedule) == {"task_1_renamed"}
+
+
+def test_delta_schedule_only_reads_changes(engine, session_scope, make_scheduler):
+    long_ago = dt.datetime(2000, 1, 1)
+    for name in ("task_1", "task_2", "task_3"):
+        add_task(session_scope, name, date_changed=long_ago)
+    add_task(session_scope, "task_4", date_changed=long_ago + dt.timedelta(hours=1))
+    scheduler = make_scheduler(delta_reload=True)
+    scheduler.reserve(scheduler.schedule["task_1"])
+    scheduler.sync()
+    with session_scope() as session:
+        delete_tasks(session, name_prefix="task_2")
+    statements = []
+    sqlalchemy.event.listen(
+        engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+
+    changed, removed = scheduler.delta_schedule()
+
+    # the synced run state is not a change, only the row at the watermark is read again,
+    # the deleted task is found in the tombstones
+    assert set(changed) == {"task_4"}
+    assert removed == {"task_2"}
+    assert set(scheduler._schedule or {}) == {"task_1", "task_3", "task_4"}
+    task_selects = [s for s in statements if "FROM scheduler.celery_periodic_task " in s]
+    assert len(task_selects) == 1
+    assert "date_changed >=" in task_selects[0]
+
+
+def test_delta_reload_patches_heap(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    scheduler = make_scheduler(delta_reload=True)
+    scheduler.tick()
+    scheduler._last_timestamp = dt.datetime(2000, 1, 1)
+
+    add_task(session_scope, "task_2")
+    scheduler.tick()
+
+    assert {event[2].name for event in scheduler._heap or []} == {"task_1", "task_2"}
+    assert set(scheduler.old_schedulers or {}) == {"task_1", "task_2"}
+
+
+def test_delta_reload_falls_back_to_full_reload(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    scheduler = make_scheduler(delta_reload=True, delta_reload_max_age=60)
+    schedule = scheduler.schedule
+    assert scheduler.schedule is schedule
+
+    # a write stamped before the delta watermark, e.g. by a long PostgreSQL transaction
+    task = add_task(session_scope, "task_2")
+    with session_scope() as session:
+        session.query(PeriodicTask).filter_by(id=task.id).update(
+            {"date_changed": dt.datetime(2000, 1, 1)}, synchronize_session=False
+        )
+    assert scheduler._last_full_reload is not None
+    scheduler._last_full_reload -= 60
+
+    assert set(scheduler.schedule) == {"task_1", "task_2"}
+    assert scheduler.schedule is not schedule
+
+
+def test_sync_saves_dirty_entries_in_one_statement(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    add_task(session_scope, "task_2")
+    scheduler = make_scheduler()
+    for name in ("task_1", "task_2"):
+        scheduler.schedule[name] = scheduler.reserve(scheduler.schedule[name])
+
+    with patch.object(ModelEntry, "save") as save:
+        scheduler.sync()
+
+    save.assert_not_called()
+    assert not scheduler._dirty
+    with session_scope() as session:
+        assert [task.total_run_count for task in session.query(PeriodicTask)] == [1, 1]
+
+
+def test_sync_isolates_failed_rows(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    add_task(session_scope, "task_2")
+    scheduler = make_scheduler()
+    for name in ("task_1", "task_2"):
+        scheduler.schedule[name] = scheduler.reserve(scheduler.schedule[name])
+    scheduler._dirty.add("removed_task")
+
+    def save(entry, fields=()):
+        if entry.name == "task_2":
+            raise sqlalchemy.exc.OperationalError("UPDATE", {}, Exception())
+
+    with patch.object(ModelEntry, "save_many", side_effect=Exception("bulk failed")):
+        with patch.object(ModelEntry, "save", autospec=True, side_effect=save) as save_entry:
+            scheduler.sync()
+
+    assert save_entry.call_count == 2
+    assert scheduler._dirty == {"task_2", "removed_task"}
+
+
+def test_all_as_schedule_disables_task_without_crontab(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    with session_scope() as session:
+        session.add(PeriodicTask(name="task_2", task="echo"))
+
+    scheduler = make_scheduler()
+
+    assert scheduler.schedule["task_2"].enabled is False
+    with session_scope() as session:
+        assert session.query(PeriodicTask).filter_by(name="task_2").one().enabled is False
+
+
+def test_populate_heap_evaluates_crontabs_in_batch(session_scope, make_scheduler):
+    add_task(session_scope, "task_1")
+    add_task(session_scope, "task_2", minute="0", start_time=dt.datetime(2000, 1, 1))
+    scheduler = make_scheduler()
+
+    with patch.object(ModelEntry, "is_due", autospec=True, side_effect=ModelEntry.is_due) as is_due:
+        scheduler.populate_heap()
+
+    assert [call.args[0].name for call in is_due.call_args_list] == ["task_2"]
+    assert {event[2].name for event in scheduler._heap or []} == {"task_1", "task_2"}
+    event = next(event for event in scheduler._heap or [] if event[2].name == "task_1")
+    assert event[0] <= scheduler._when(scheduler.schedule["task_1"], 60)
+
+
+def test_next_entry_carries_over_decoded_fields(app, session_scope, make_scheduler):
+    add_task(session_scope, "task_1", args="[1, 2]")
+    scheduler = make_scheduler()
+    entry = scheduler.schedule["task_1"]
+
+    with patch("rdbbeat.schedulers.loads") as loads:
+        next_entry = next(entry)
+
+    loads.assert_not_called()
+    assert next_entry is not entry
+    assert next_entry.args is entry.args == [1, 2]
+    assert next_entry.schedule is entry.schedule
+    assert next_entry.total_run_count == entry.total_run_count + 1 == 1
+    assert next_entry.last_run_at >= entry.last_run_at
+    assert next_entry.last_run_at.tzinfo == app.timezone
+
+
+def test_schedule_changed_with_change_log(monkeypatch, session_scope, make_scheduler):
+    monkeypatch.setattr(PeriodicTaskChanged, "tracking", CHANGE_LOG)
+    monkeypatch.setattr(schedulers, "CHANGE_LOG_LOOKBACK", 2)
+    scheduler = make_scheduler(change_tracking=CHANGE_LOG)
+    scheduler.change_log_prune_interval = 0
+    assert scheduler.schedule_changed() is False
+
+    add_task(session_scope, "task_1")
+    assert scheduler.schedule_changed() is True
+    assert scheduler.schedule_changed() is False
+
+    add_task(session_scope, "task_2")
+    add_task(session_scope, "task_3")
+    assert scheduler.schedule_changed() is True
+    with session_scope() as session:
+        # the lookback window is kept
+        assert session.query(PeriodicTaskChangeLog.id).all() == [(2,), (3,)]
+        assert session.query(PeriodicTaskChanged).count() == 0
+
+
+def test_change_log_entry_committed_late(monkeypatch, session_scope, make_scheduler):
+    monkeypatch.setattr(PeriodicTaskChanged, "tracking", CHANGE_LOG)
+    with session_scope() as session:
+        session.add(PeriodicTaskChangeLog(id=5))
+    scheduler = make_scheduler(change_tracking=CHANGE_LOG)
+    assert scheduler.schedule_changed() is False
+
+    # sequence 3 was taken before 5, but committed after it was read
+    with session_scope() as session:
+        session.add(PeriodicTaskChangeLog(id=3))
+    assert scheduler.schedule_changed() is True
+    assert scheduler.schedule_changed() is False
+
+
+def test_change_tracking_mismatch(make_scheduler):
+    assert PeriodicTaskChanged.tracking != CHANGE_LOG
+    with pytest.raises(ValueError, match="does not match"):
+        make_scheduler(change_tracking=CHANGE_LOG)
+    assert PeriodicTaskChanged.tracking != CHANGE_LOG
+
+
+def test_horizon_loads_entries_due_soon(monkeypatch, app, session_scope, make_scheduler):
+    now = dt.datetime.now(pytz.utc)
+    add_task(session_scope, "task_near", next_run_at=now + dt.timedelta(minutes=1))
+    add_task(session_scope, "task_far", next_run_at=now + dt.timedelta(hours=1))
+    add_task(session_scope, "task_unknown")
+    scheduler = make_scheduler(horizon=600)
+    assert scheduler.max_interval == 5
+
+    assert set(scheduler.schedule) == {"task_near", "task_unknown"}
+    scheduler.populate_heap()
+
+    # task_near ran, and its next run is past the next window
+    entry = scheduler.reserve(scheduler.schedule["task_near"])
+    assert scheduler._schedule is not None
+    scheduler._schedule["task_near"] = entry
+    entry.model.next_run_at = now + dt.timedelta(hours=2)
+    monkeypatch.setattr(app, "now", lambda: now + dt.timedelta(minutes=55))
+
+    assert set(scheduler.schedule) == {"task_near", "task_far", "task_unknown"}
+    assert {event[2].name for event in scheduler._heap or []} == set(scheduler.schedule)
+
+    # evicted once its run state is saved
+    scheduler.sync()
+    monkeypatch.setattr(app, "now", lambda: now + dt.timedelta(minutes=61))
+    assert set(scheduler.schedule) == {"task_far", "task_unknown"}
+    with session_scope() as session:
+        task = session.query(PeriodicTask).filter_by(name="task_near").one()
+        assert task.total_run_count == 1
+        assert task.next_run_at == (now + dt.timedelta(hours=2)).replace(tzinfo=None)
+
+
+def test_next_entry_updates_next_run_at(session_scope, make_scheduler):
+    add_task(session_scope, "task_1", minute="0")
+    scheduler = make_scheduler()
+    entry = next(scheduler.schedule["task_1"])
+
+    next_run_at = entry.model.next_run_at
+    assert next_run_at.tzinfo is pytz.utc
+    assert next_run_at > entry.last_run_at
+    assert next_run_at.minute == 0
+
+
+def test_spread_offsets_tasks_sharing_a_crontab(app, session_scope, make_scheduler):
+    app.conf.beat_spread_window = 300
+    for i in range(10):
+        add_task(session_scope, f"task_{i}", minute="0")
+    add_task(session_scope, "task_exact", minute="0", spread_window=0)
+    scheduler = make_scheduler()
+
+    offsets = {name: entry.schedule.offset for name, entry in scheduler.schedule.items()}
+    assert offsets.pop("task_exact") == dt.timedelta(0)
+    assert len(set(offsets.values())) > 1
+    assert all(dt.timedelta(0) <= offset < dt.timedelta(seconds=300) for offset in offsets.values())
+    # stable across restarts
+    restarted = make_scheduler()
+    assert {name: entry.schedule.offset for name, entry in restarted.schedule.items()} == dict(
+        offsets, task_exact=dt.timedelta(0)
+    )
+
+    # the batched heap computation agrees with `is_due`
+    scheduler.populate_heap()
+    for event in scheduler._heap or []:
+        _, delay = event.entry.is_due()
+        assert abs(event.time - scheduler._when(event.entry, delay)) < 1
+
+
+def test_batch_dispatch_sends_due_entries_in_one_tick(app, session_scope, make_scheduler):
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(hours=2)
+    for i in range(5):
+        add_task(session_scope, f"task_{i}", minute="0", last_run_at=last_run_at, args=f"[{i}]")
+    add_task(session_scope, "task_later", minute="0")
+    scheduler = make_scheduler(batch_dispatch=True)
+
+    with app.connection_for_read() as connection:
+        queue = connection.SimpleQueue("celery")
+        scheduler.producer
+        with patch.object(
+            scheduler, "_ensure_connected", wraps=scheduler._ensure_connected
+        ) as ensure:
+            assert scheduler.tick() == 0
+        assert ensure.call_count == 1
+        messages = [queue.get(timeout=1) for _ in range(5)]
+        assert sorted(message.payload[0] for message in messages) == [[i] for i in range(5)]
+        assert queue.qsize() == 0
+        queue.close()
+
+    assert 0 < scheduler.tick() <= scheduler.max_interval
+    assert scheduler.schedule["task_0"].model.total_run_count == 1
+    assert scheduler.schedule["task_later"].model.total_run_count == 0
+    scheduler.sync()
+    with session_scope() as session:
+        counts = dict(session.query(PeriodicTask.name, PeriodicTask.total_run_count))
+    assert counts == {
+        "task_0": 1,
+        "task_1": 1,
+        "task_2": 1,
+        "task_3": 1,
+        "task_4": 1,
+        "task_later": 0,
+    }
+
+
+def test_payload_cache_serializes_message_once(app, session_scope, make_scheduler):
+    add_task(session_scope, "task_1", args="[1]", kwargs='{"a": 2}')
+    scheduler = make_scheduler(payload_cache=True)
+    entry = scheduler.schedule["task_1"]
+
+    with app.connection_for_read() as connection:
+        queue = connection.SimpleQueue("celery")
+        with patch("rdbbeat.payload.dumps", wraps=dumps) as serialize:
+            scheduler.apply_async(entry, producer=scheduler.producer)
+            scheduler.apply_async(scheduler.schedule["task_1"], producer=scheduler.producer)
+        assert serialize.call_count == 1
+        messages = [queue.get(timeout=1) for _ in range(2)]
+        queue.close()
+
+    assert [message.payload[:2] for message in messages] == [[[1], {"a": 2}]] * 2
+    ids = [message.headers["id"] for message in messages]
+    assert ids[0] != ids[1]
+    assert [message.properties["correlation_id"] for message in messages] == ids
+    assert messages[0].headers["task"] == "echo"
+    assert scheduler.schedule["task_1"].model.total_run_count == 2
+
+    # a reload builds the payload again
+    assert make_scheduler().schedule["task_1"]._payloads == {}
+
+
+def test_metrics_record_beat_loop(session_scope, make_scheduler):
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(hours=2)
+    add_task(session_scope, "task_1", minute="0", last_run_at=last_run_at)
+    metrics = PrometheusMetrics()
+    scheduler = make_scheduler(metrics=metrics, batch_dispatch=True)
+
+    assert scheduler.tick() == 0
+    scheduler.sync()
+
+    histograms = metrics._histograms
+    assert metrics._values["rdbbeat_reload_entries"][()] == 1
+    assert metrics._values["rdbbeat_dispatches_total"][(("queue", "celery"),)] == 1
+    lag = histograms["rdbbeat_dispatch_lag_seconds"][(("queue", "celery"),)]
+    # due since the first top of the hour after the last run
+    assert 3600 <= lag[-1] <= 7200
+    assert sum(histograms["rdbbeat_tick_duration_seconds"][()][:-1]) == 1
+    assert sum(histograms["rdbbeat_sync_duration_seconds"][()][:-1]) >= 1
+    assert histograms["rdbbeat_sync_entries"][()][-1] >= 1
+    assert "rdbbeat_schedule_changed_duration_seconds" in histograms
+
+
+def test_metrics_per_task_labels(session_scope, make_scheduler):
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(hours=2)
+    add_task(session_scope, "task_1", minute="0", last_run_at=last_run_at)
+    metrics = PrometheusMetrics()
+    scheduler = make_scheduler(metrics=metrics, metrics_per_task=True)
+
+    assert scheduler.tick() == 0
+
+    labels = (("queue", "celery"), ("task", "task_1"))
+    assert metrics._values["rdbbeat_dispatches_total"] == {labels: 1}
+    assert list(metrics._histograms["rdbbeat_dispatch_lag_seconds"]) == [labels]
+
+
+def test_catch_up_skip_drops_missed_runs(session_scope, make_scheduler):
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(hours=2)
+    add_task(session_scope, "task_1", minute="0", last_run_at=last_run_at, catch_up="skip")
+    scheduler = make_scheduler()
+    entry = scheduler.schedule["task_1"]
+
+    is_due, next_time_to_run = scheduler.is_due(entry)
+    assert not is_due
+    assert 0 < next_time_to_run <= 3600
+    assert entry.model.total_run_count == 0
+    assert entry.model.next_run_at > dt.datetime.now(pytz.utc)
+    assert "task_1" in scheduler._dirty
+
+
+def test_catch_up_ignores_runs_due_after_start(session_scope, make_scheduler):
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(hours=2)
+    add_task(session_scope, "task_1", minute="0", last_run_at=last_run_at, catch_up="skip")
+    scheduler = make_scheduler()
+    # beat has been up since before the run was due, it is late rather than missed
+    scheduler._started_at = last_run_at
+    entry = scheduler.schedule["task_1"]
+
+    assert scheduler.is_due(entry)[0]
+    assert "task_1" not in scheduler._dirty
+
+
+def test_catch_up_replay_runs_missed_fire_times_at_bounded_rate(session_scope, make_scheduler):
+    now = dt.datetime.now(pytz.utc).replace(second=0, microsecond=0)
+    add_task(session_scope, "task_1", last_run_at=now - dt.timedelta(minutes=5))
+    scheduler = make_scheduler(catch_up="replay", catch_up_rate=1000)
+    entry = scheduler.schedule["task_1"]
+
+    run_times = []
+    while scheduler.is_due(entry)[0]:
+        entry = scheduler.reserve(entry)
+        run_times.append(entry.model.last_run_at)
+    # the runs missed 4 to 1 minutes ago are replayed, the current one runs as usual
+    assert run_times[:4] == [now - dt.timedelta(minutes=minutes) for minutes in (4, 3, 2, 1)]
+    assert run_times[4] >= now
+    assert entry.model.total_run_count == 5
+
+    scheduler = make_scheduler(catch_up="replay", catch_up_rate=1)
+    entry = scheduler.schedule["task_1"]
+    entry.last_run_at = entry.model.last_run_at = now - dt.timedelta(minutes=5)
+    assert scheduler.is_due(entry)[0]
+    entry = scheduler.reserve(entry)
+    is_due, next_time_to_run = scheduler.is_due(entry)
+    assert not is_due
+    assert 0 < next_time_to_run <= 1
+
+
+def test_queue_rate_limits_defer_excess_entries(session_scope, make_scheduler):
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(hours=2)
+    for i in range(3):
+        add_task(session_scope, f"slow_{i}", minute="0", last_run_at=last_run_at, queue="slow")
+    for i in range(2):
+        add_task(session_scope, f"fast_{i}", minute="0", last_run_at=last_run_at, queue="fast")
+    metrics = PrometheusMetrics()
+    scheduler = make_scheduler(batch_dispatch=True, queue_rate_limits={"slow": 1}, metrics=metrics)
+
+    with patch.object(scheduler, "send_entry") as send_entry:
+        assert scheduler.tick() == 0
+        sent = {call.args[0].name for call in send_entry.call_args_list}
+        slow_sent = sent - {"fast_0", "fast_1"}
+        assert len(sent) == 3 and len(slow_sent) == 1
+
+        # the deferred entries wait for a token of their queue
+        send_entry.reset_mock()
+        assert 0 < scheduler.tick() <= 1
+        assert not send_entry.called
+
+    assert metrics._values["rdbbeat_deferrals_total"][(("queue", "slow"),)] == 4
+    counts = {name: entry.model.total_run_count for name, entry in scheduler.schedule.items()}
+    assert counts == {name: int(name in sent) for name in counts}
+
+
+def test_global_rate_limit_sends_deferred_entries_one_per_token(session_scope, make_scheduler):
+    last_run_at = dt.datetime.now(pytz.utc) - dt.timedelta(hours=2)
+    for i in range(3):
+        add_task(session_scope, f"task_{i}", minute="0", last_run_at=last_run_at)
+    scheduler = make_scheduler(rate_limit=1)
+    clock = [1000.0]
+    assert scheduler.rate_limit_bucket is not None
+    scheduler.rate_limit_bucket.timestamp = clock[0]
+
+    sent = []
+    with patch("kombu.utils.limits.monotonic", lambda: clock[0]), patch.object(
+        scheduler, "apply_entry"
+    ) as apply_entry:
+        for _ in range(3):
+            assert scheduler.tick() == 0
+            sent.append(apply_entry.call_args.args[0].name)
+            if len(sent) < 3:
+                assert scheduler.tick() == 1
+            clock[0] += 1
+        assert scheduler.tick() == scheduler.max_interval
+    assert sorted(sent) == ["task_0", "task_1", "task_2"]
@@ -0,0 +1,79 @@
+import datetime as dt
+
+from rdbbeat.db.models import BeatLease, CrontabSchedule, PeriodicTask
+from rdbbeat.sharding import HashRing, ShardMembership
+
+names = [f"task_{i}" for i in range(200)]
+
+
+def test_hash_ring_moves_only_the_new_members_share():
+    before = HashRing(["a", "b"])
+    after = HashRing(["a", "b", "c"])
+
+    moved = [name for name in names if before.owner(name) != after.owner(name)]
+
+    assert moved
+    assert all(after.owner(name) == "c" for name in moved)
+    assert HashRing([]).owner("task_1") is None
+
+
+def test_members_partition_tasks(session_scope):
+    first = ShardMembership(session_scope, member_id="beat-1")
+    second = ShardMembership(session_scope, member_id="beat-2")
+
+    assert first.heartbeat() is True
+    assert second.heartbeat() is True
+    assert first.heartbeat() is True
+    assert first.heartbeat() is False
+
+    assert first.members == second.members == ["beat-1", "beat-2"]
+    owned_by_first = {name for name in names if first.owns(name)}
+    owned_by_second = {name for name in names if second.owns(name)}
+    assert owned_by_first and owned_by_second
+    assert owned_by_first.isdisjoint(owned_by_second)
+    assert owned_by_first | owned_by_second == set(names)
+
+
+def test_expired_member_is_removed(session_scope):
+    with session_scope() as session:
+        session.add(
+            BeatLease(
+                member_id="dead",
+                expires_at=dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=1),
+            )
+        )
+    membership = ShardMembership(session_scope, member_id="beat-1")
+
+    membership.heartbeat()
+
+    assert membership.members == ["beat-1"]
+    assert all(membership.owns(name) for name in names)
+    with session_scope() as session:
+        assert [lease.member_id for lease in session.query(BeatLease)] == ["beat-1"]
+
+
+def test_sharded_schedulers(session_scope, make_scheduler):
+    with session_scope() as session:
+        crontab = CrontabSchedule(minute="0")
+        for name in names[:20]:
+            session.add(PeriodicTask(name=name, task="echo", crontab=crontab))
+    first = ShardMembership(session_scope, member_id="beat-1")
+    second = ShardMembership(session_scope, member_id="beat-2")
+    second.heartbeat()
+
+    first_scheduler = make_scheduler(membership=first)
+    second_scheduler = make_scheduler(membership=second)
+    # the second member learns about the first one on its next heartbeat
+    second_scheduler._last_heartbeat = None
+    first_scheduler._last_heartbeat = None
+
+    first_names = set(first_scheduler.schedule)
+    second_names = set(second_scheduler.schedule)
+
+    assert first_names.isdisjoint(second_names)
+    assert first_names | second_names == set(names[:20])
+    assert first_scheduler.max_interval == 5
+
+    first_scheduler.close()
+    second_scheduler._last_heartbeat = None
+    assert set(second_scheduler.schedule) == set(names[:20])
@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import event
+
+from rdbbeat.db.models import CrontabSchedule, PeriodicTask
+from rdbbeat.db.snapshot import PeriodicTaskSnapshot, iter_task_snapshots
+from rdbbeat.tzcrontab import TzAwareCrontab
+
+
+def test_iter_task_snapshots(session_scope):
+    with session_scope() as session:
+        session.add(PeriodicTask(name="task_1", task="echo", crontab=CrontabSchedule(minute="5")))
+        session.add(PeriodicTask(name="task_2", task="echo", enabled=False))
+
+    with session_scope() as session:
+        snapshots = list(iter_task_snapshots(session, PeriodicTask.enabled.is_(True), yield_per=1))
+
+    assert len(snapshots) == 1
+    snapshot = snapshots[0]
+    assert isinstance(snapshot, PeriodicTaskSnapshot)
+    assert (snapshot.name, snapshot.task, snapshot.total_run_count) == ("task_1", "echo", 0)
+    assert snapshot.schedule == TzAwareCrontab(minute="5")
+
+
+def test_iter_task_snapshots_single_query(engine, session_scope):
+    with session_scope() as session:
+        for i in range(10):
+            session.add(
+                PeriodicTask(name=f"task_{i}", task="echo", crontab=CrontabSchedule(minute=str(i)))
+            )
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    with session_scope() as session:
+        schedules = [snapshot.schedule for snapshot in iter_task_snapshots(session)]
+
+    assert len(schedules) == 10
+    assert len(statements) == 1
+
+
+def test_snapshot_without_crontab_raises(session_scope):
+    with session_scope() as session:
+        session.add(PeriodicTask(name="task_1", task="echo"))
+
+    with session_scope() as session:
+        (snapshot,) = iter_task_snapshots(session)
+
+    with pytest.raises(ValueError, match="task_1 schedule is None!"):
+        snapshot.schedule
@@ -0,0 +1,53 @@
+import datetime as dt
+import pickle
+
+import pytz
+
+from rdbbeat.tzcrontab import CrontabCache, TzAwareCrontab
+
+
+def test_crontab_cache_interns_schedules():
+    cache = CrontabCache(maxsize=10)
+
+    schedule = cache.get(minute="5", hour="1", timezone="Europe/Berlin")
+
+    assert schedule == TzAwareCrontab(minute="5", hour="1", tz=pytz.timezone("Europe/Berlin"))
+    assert cache.get(minute="5", hour="1", timezone="Europe/Berlin") is schedule
+    assert cache.get(minute="5", hour="1") is not schedule
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+
+def test_crontab_cache_evicts_least_recently_used():
+    cache = CrontabCache(maxsize=2)
+    first = cache.get(minute="1")
+    cache.get(minute="2")
+    cache.get(minute="1")
+    cache.get(minute="3")
+
+    assert len(cache) == 2
+    assert cache.get(minute="1") is first
+    assert cache.misses == 3
+
+    cache.resize(1)
+    assert len(cache) == 1
+    assert cache.get(minute="1") is first
+
+
+def test_crontab_cache_disabled():
+    cache = CrontabCache(maxsize=0)
+
+    assert cache.get(minute="1") is not cache.get(minute="1")
+    assert len(cache) == 0
+
+
+def test_crontab_with_offset():
+    schedule = TzAwareCrontab(minute="0")
+    spread = schedule.with_offset(90)
+
+    assert spread.mask is schedule.mask
+    assert spread != schedule
+    assert pickle.loads(pickle.dumps(spread)) == spread
+    last_run_at = dt.datetime(2026, 1, 1, 10, 1, 30, tzinfo=pytz.utc)
+    assert spread.next_fire(last_run_at) == dt.datetime(2026, 1, 1, 11, 1, 30, tzinfo=pytz.utc)
+    assert spread.next_fire(last_run_at - dt.timedelta(minutes=1)) == last_run_at
+    assert spread.next_run_at(last_run_at) == dt.datetime(2026, 1, 1, 11, 1, 30, tzinfo=pytz.utc)